@@ -1,3 +1,4 @@
+import numbers
 import numpy as np
 import wireframe as wf
 
@@ -11,83 +12,197 @@ def Cuboid((x,y,z), (w,h,d)):
     
     return cuboid
     
-def Spheroid((x,y,z), (rx, ry, rz), resolution=10):
-    """ Returns a wireframe spheroid centred on (x,y,z)
-        with a radii of (rx,ry,rz) in the respective axes. """
-    
-    spheroid   = wf.Wireframe()
-    latitudes  = [n*np.pi/resolution for n in range(1,resolution)]
-    longitudes = [n*2*np.pi/resolution for n in range(resolution)]
+# Unit spheroid wireframes, keyed by resolution
+spheroid_templates = {}
 
+def unitSpheroid(resolution):
+    """ Return a wireframe sphere centred on the origin with a radius of 1.
+        The wireframe is cached, so copy it rather than changing it. """
+    
+    if resolution in spheroid_templates:
+        return spheroid_templates[resolution]
+    
+    spheroid = wf.Wireframe()
+    latitudes  = np.arange(1, resolution) * np.pi / resolution
+    longitudes = np.arange(resolution) * 2 * np.pi / resolution
+    
     # Add nodes except for poles
-    spheroid.addNodes([(x + rx*np.sin(n)*np.sin(m), y - ry*np.cos(m), z - rz*np.cos(n)*np.sin(m)) for m in latitudes for n in longitudes])
-
+    (m, n) = [a.ravel() for a in np.meshgrid(latitudes, longitudes, indexing='ij')]
+    spheroid.addNodes(np.column_stack((np.sin(n)*np.sin(m), -np.cos(m), -np.cos(n)*np.sin(m))))
+    
     # Add square faces to whole spheroid but poles
     num_nodes = resolution*(resolution-1)
-    spheroid.addFaces([(m+n, (m+resolution)%num_nodes+n, (m+resolution)%resolution**2+(n+1)%resolution, m+(n+1)%resolution) for n in range(resolution) for m in range(0,num_nodes-resolution,resolution)])
-
+    (n, m) = [a.ravel() for a in np.meshgrid(np.arange(resolution), np.arange(0, num_nodes-resolution, resolution), indexing='ij')]
+    spheroid.addFaces(np.column_stack((m+n, m+resolution+n, m+resolution+(n+1)%resolution, m+(n+1)%resolution)))
+    
     # Add poles and triangular faces around poles
-    spheroid.addNodes([(x, y+ry, z),(x, y-ry, z)])
-    spheroid.addFaces([(n, (n+1)%resolution, num_nodes+1) for n in range(resolution)])
+    spheroid.addNodes([(0, 1, 0), (0, -1, 0)])
+    n = np.arange(resolution)
+    spheroid.addFaces(np.column_stack((n, (n+1)%resolution, np.repeat(num_nodes+1, resolution))))
     start_node = num_nodes-resolution
-    spheroid.addFaces([(num_nodes, start_node+(n+1)%resolution, start_node+n) for n in range(resolution)])
-
+    spheroid.addFaces(np.column_stack((np.repeat(num_nodes, resolution), start_node+(n+1)%resolution, start_node+n)))
+    
+    spheroid_templates[resolution] = spheroid
     return spheroid
+
+def Spheroid((x,y,z), (rx, ry, rz), resolution=10):
+    """ Returns a wireframe spheroid centred on (x,y,z)
+        with a radii of (rx,ry,rz) in the respective axes. """
+    
+    return unitSpheroid(resolution).copy(spheroidMatrix((x,y,z), (rx, ry, rz)))
+
+def spheroidMatrix((x,y,z), (rx, ry, rz)):
+    """ Return the matrix that scales the unit spheroid by (rx,ry,rz) and moves it to be centred on (x,y,z). """
+    
+    return np.array([[rx,0,0,0],
+                     [0,ry,0,0],
+                     [0,0,rz,0],
+                     [x,y,z,1]], dtype=float)
+
+class SpheroidLOD(wf.Wireframe):
+    """ A wireframe spheroid that chooses its resolution from how large it appears on screen.
+        The viewer calls chooseResolution each frame with the spheroid's size in pixels. """
+    
+    def __init__(self, (x,y,z), (rx, ry, rz), resolutions=(6, 10, 16, 26, 40, 52), segment_pixels=12, colour=(255,255,255)):
+        wf.Wireframe.__init__(self)
+        self.resolutions = sorted(resolutions)
+        self.segment_pixels = segment_pixels
+        self.colour = colour
+        self.resolution = None
+        
+        # Matrix from the unit spheroid to the stored nodes, before self.matrix is applied
+        self.model_matrix = spheroidMatrix((x,y,z), (rx, ry, rz))
+        self.setResolution(self.resolutions[-1])
+    
+    def setResolution(self, resolution):
+        """ Replace the nodes, edges and faces with those of a spheroid of the given resolution. """
+        
+        # model_matrix must include any transforms of a packed group this spheroid is in
+        self.applyGroupTransform()
+        template = unitSpheroid(resolution)
+        
+        colours = np.empty((len(template.face_colours), 3), np.uint8)
+        colours[:] = self.colour
+        
+        # Replacing the nodes resets self.matrix, so keep any pending transform.
+        # Normals are only ever replaced, so can be shared with the template, and are transformed when next read.
+        (matrix, identity) = (self.matrix, self._identity)
+        self.setArrays(np.dot(template.nodes, self.model_matrix), template.edges, template.face_nodes, template.face_offsets, colours,
+                       template.faceNormals(), template.nodeNormals(), wf.normalMatrix(self.model_matrix))
+        self.resolution = resolution
+        
+        if not identity:
+            self.setMatrix(matrix)
+    
+    def chooseResolution(self, screen_size):
+        """ Use the lowest resolution that keeps each segment of the circumference under segment_pixels long. """
+        
+        needed = np.pi * screen_size / self.segment_pixels
+        resolution = next((r for r in self.resolutions if r >= needed), self.resolutions[-1])
+        if resolution != self.resolution:
+            self.setResolution(resolution)
+    
+    def nodesChanged(self, matrix=None, normal_matrix=None):
+        """ Keep model_matrix in step when the stored nodes are transformed, by applyTransform or a packed group. """
+        
+        self.applyGroupTransform()
+        if matrix is not None:
+            self.model_matrix = np.dot(self.model_matrix, matrix)
+        wf.Wireframe.nodesChanged(self, matrix, normal_matrix)
     
 def HorizontalGrid((x,y,z), (dx,dz), (nx,nz)):
     """ Returns a nx by nz wireframe grid that starts at (x,y,z) with width dx.nx and depth dz.nz. """
     
-    grid = wf.Wireframe()
-    grid.addNodes([[x+n1*dx, y, z+n2*dz] for n1 in range(nx+1) for n2 in range(nz+1)])
-    grid.addEdges([(n1*(nz+1)+n2,n1*(nz+1)+n2+1) for n1 in range(nx+1) for n2 in range(nz)])
-    grid.addEdges([(n1*(nz+1)+n2,(n1+1)*(nz+1)+n2) for n1 in range(nx) for n2 in range(nz+1)])
+    (xs, zs) = np.meshgrid(x + dx*np.arange(nx+1), z + dz*np.arange(nz+1), indexing='ij')
+    grid = wf.Wireframe(np.column_stack((xs.ravel(), np.repeat(y, xs.size), zs.ravel())))
+    grid.addEdges(gridEdges(nx+1, nz+1))
     
     return grid
     
-def FractalLandscape(origin=(0,0,0), dimensions=(400,400), iterations=4, height=40):
-    import random
+def gridEdges(rows, cols):
+    """ Return an (E, 2) array of the edges joining neighbouring nodes in a grid with node r*cols + c at row r and column c.
+        Edges along each row come first, then edges down each column, so consecutive edges join up. """
+    
+    nodes = np.arange(rows*cols).reshape(rows, cols)
+    along_rows = np.column_stack((nodes[:,:-1].ravel(), nodes[:,1:].ravel()))
+    down_cols = np.column_stack((nodes[:-1].T.ravel(), nodes[1:].T.ravel()))
+    return np.vstack((along_rows, down_cols))
+
+def gridFaces(rows, cols):
+    """ Return an (F, 3) array of the two triangles in each square of a grid with node r*cols + c at row r and column c. """
     
-    def midpoint(nodes):
-        m = 1.0/ len(nodes)
-        x = m * sum(n[0] for n in nodes) 
-        y = m * sum(n[1] for n in nodes) 
-        z = m * sum(n[2] for n in nodes) 
-        return [x,y,z]
+    corners = np.arange(rows*cols).reshape(rows, cols)[:-1,:-1].ravel()
+    return np.vstack((np.column_stack((corners, corners+1, corners+cols)),
+                      np.column_stack((corners+1, corners+cols+1, corners+cols))))
+
+def randomGenerator(rng=None):
+    """ Return a source of random numbers from a seed, a numpy RandomState or Generator, or None for numpy's global one. """
     
-    (x,y,z) = origin
-    (dx,dz) = dimensions
-    nodes = [[x, y, z], [x+dx, y, z], [x+dx, y, z+dz], [x, y, z+dz]]
-    edges = [(0,1), (1,2), (2,3), (3,0)]
-    size = 2
+    if rng is None:
+        return np.random
+    if isinstance(rng, numbers.Integral):
+        return np.random.RandomState(rng)
+    return rng
 
+def subdivide(heights):
+    """ Return a grid of heights with a new point between each pair of neighbouring points and in the centre of each square.
+        The new points are the mean of the points around them. """
+    
+    (rows, cols) = heights.shape
+    new_heights = np.empty((2*rows-1, 2*cols-1))
+    new_heights[::2,::2] = heights
+    new_heights[1::2,::2] = 0.5*(heights[:-1] + heights[1:])
+    new_heights[::2,1::2] = 0.5*(heights[:,:-1] + heights[:,1:])
+    new_heights[1::2,1::2] = 0.25*(heights[:-1,:-1] + heights[:-1,1:] + heights[1:,:-1] + heights[1:,1:])
+    return new_heights
+
+def fractalHeights(iterations=4, height=40, rng=None):
+    """ Return a (2^iterations + 1) square array of heights made by midpoint displacement.
+        Each iteration subdivides the grid, then moves every point by a random amount that shrinks with each iteration. """
+    
+    rng = randomGenerator(rng)
+    heights = np.zeros((2,2))
+    
     for i in range(iterations):
-        # Add nodes midway between each edge
-        for (n1, n2) in edges:
-            nodes.append(midpoint([nodes[n1], nodes[n2]]))
+        heights = subdivide(heights)
+        heights += rng.uniform(-0.5, 0.5, heights.shape) * height/2**(i*0.8)
+    
+    return heights
 
-        # Add nodes to the centre of each square
-        squares = [(x+y*size, x+y*size+1, x+(y+1)*size+1, x+(y+1)*size) for y in range(size-1) for x in range(size-1)]
-        for (n1,n2,n3,n4) in squares:
-            nodes.append(midpoint([nodes[n1], nodes[n2], nodes[n3], nodes[n4]]))
-        
-        # Sort in order of grid
-        nodes.sort(key=lambda node: (node[2],node[0]))
-        
-        size = size*2-1
-        # Horizontal edge
-        edges = [(x+y*size, x+y*size+1) for y in range(size) for x in range(size-1)]
-        # Vertical edges
-        edges.extend([(x+y*size, x+(y+1)*size) for x in range(size) for y in range(size-1)])
-        
-        # Shift node heights
-        scale = height/2**(i*0.8)
-        for node in nodes:
-            node[1] += (random.random()-0.5)*scale
+def heightMapNodes(origin, dimensions, heights):
+    """ Return an (N, 4) array of the nodes of a height map as homogeneous coordinates,
+        in rows of increasing z, each with increasing x. """
     
-    grid = wf.Wireframe(nodes)
-    grid.addEdges(edges)
+    (x,y,z) = origin
+    (dx,dz) = dimensions
+    (rows, cols) = heights.shape
+    (zs, xs) = np.meshgrid(np.linspace(z, z+dz, rows), np.linspace(x, x+dx, cols), indexing='ij')
+    return np.column_stack((xs.ravel(), y + heights.ravel(), zs.ravel(), np.ones(xs.size)))
+
+def HeightMap(origin, dimensions, heights, faces=False, colour=(255,255,255)):
+    """ Returns a wireframe grid that starts at origin and covers an area of (dx, dz),
+        with the height of each node added to its y-coordinate.
+        heights is a 2D array with a row for each z-coordinate and a column for each x-coordinate.
+        If faces is True, each grid square gets two triangular faces, and their edges. """
+    
+    (rows, cols) = heights.shape
+    grid = wf.Wireframe()
+    grid.setArrays(heightMapNodes(origin, dimensions, heights))
+    
+    # Faces add their own edges, including the grid edges
+    if faces:
+        grid.addFaces(gridFaces(rows, cols), colour)
+    else:
+        grid.addEdges(gridEdges(rows, cols))
     
     return grid
+
+def FractalLandscape(origin=(0,0,0), dimensions=(400,400), iterations=4, height=40, rng=None, faces=False, colour=(255,255,255)):
+    """ Returns a wireframe landscape that starts at origin and covers an area of (dx, dz),
+        with heights made by midpoint displacement on a (2^iterations + 1) square grid.
+        rng is a seed or a numpy RandomState or Generator. If faces is True, each grid square gets two triangular faces. """
+    
+    return HeightMap(origin, dimensions, fractalHeights(iterations, height, rng), faces, colour)
     
 if __name__ == '__main__':
     grid = FractalLandscape(origin = (0,400,0), iterations=1)
@@ -0,0 +1,112 @@
+""" Render sequences of frames of a viewer's scene in parallel, using a pool of processes.
+
+    The scene's wireframes are saved once to a mesh file, which each worker memory-maps read-only,
+    so the geometry is shared between workers rather than sent to them for every frame.
+    Frames are written to image files or into a shared array of frames. """
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
+import pygame
+import wireframe as wf
+import wireframeDisplay as wd
+import meshIO
+
+# The viewer and frame array of a worker process, set up by startWorker
+worker_viewer = None
+worker_frames = None
+
+def viewerSettings(viewer):
+    """ Return a dictionary of the settings needed to draw a viewer's scene the same way in another process. """
+    
+    settings = dict((key, getattr(viewer, key)) for key in wd.VIEW_SETTINGS)
+    settings['wireframe_colours'] = dict(viewer.wireframe_colours)
+    settings['light_nodes'] = viewer.light.nodes.copy()
+    settings['size'] = (viewer.width, viewer.height)
+    return settings
+
+def startWorker(mesh_filename, settings, frames_filename, num_frames):
+    """ Create the headless viewer a worker draws with, using wireframes memory-mapped from mesh_filename,
+        and map the array of frames, if there is one. """
+    
+    global worker_viewer, worker_frames
+    
+    (width, height) = settings['size']
+    worker_viewer = wd.WireframeViewer(width, height, headless=True)
+    for name, wireframe in meshIO.loadWireframes(mesh_filename, mmap_mode='r'):
+        worker_viewer.addWireframe(name, wireframe)
+    
+    for key in wd.VIEW_SETTINGS:
+        setattr(worker_viewer, key, settings[key])
+    worker_viewer.wireframe_colours.update(settings['wireframe_colours'])
+    worker_viewer.light.nodes = settings['light_nodes']
+    
+    if frames_filename:
+        worker_frames = np.memmap(frames_filename, np.uint8, 'r+', shape=(num_frames, height, width, 3))
+
+def stopWorker():
+    """ Release the worker's viewer and frame array. """
+    
+    global worker_viewer, worker_frames
+    worker_viewer = worker_frames = None
+
+def renderFrame(task):
+    """ Draw frame i, with its matrix applied to every wireframe, and save it to filename or the array of frames. """
+    
+    (i, matrix, filename) = task
+    for wireframe in worker_viewer.wireframes.values():
+        wireframe.setMatrix(matrix)
+    
+    worker_viewer.draw()
+    if filename:
+        pygame.image.save(worker_viewer.screen, filename)
+    else:
+        worker_frames[i] = pygame.surfarray.pixels3d(worker_viewer.screen).swapaxes(0, 1)
+    return i
+
+def renderFrames(viewer, matrices, filenames=None, processes=None):
+    """ Draw a frame of the viewer's wireframes for each of a list of matrices, each applied to the scene as it is now.
+        Frames are drawn by a pool of processes, which defaults to one for each CPU; with processes=1 they're drawn here.
+        If filenames, a list of one image file name for each frame, is given, frames are saved to those files;
+        otherwise they are returned as an (F, height, width, 3) array. Terrains aren't drawn. """
+    
+    matrices = [np.asarray(matrix, dtype=float) for matrix in matrices]
+    directory = tempfile.mkdtemp()
+    try:
+        mesh_filename = os.path.join(directory, 'scene.mesh')
+        meshIO.saveWireframes(mesh_filename, viewer.wireframes.items())
+        
+        frames_filename = None
+        if filenames is None:
+            frames_filename = os.path.join(directory, 'frames')
+            frames = np.memmap(frames_filename, np.uint8, 'w+', shape=(len(matrices), viewer.height, viewer.width, 3))
+            del frames
+            filenames = [None] * len(matrices)
+        
+        tasks = [(i, matrix, filename) for i, (matrix, filename) in enumerate(zip(matrices, filenames))]
+        init_args = (mesh_filename, viewerSettings(viewer), frames_filename, len(matrices))
+        
+        if processes == 1:
+            startWorker(*init_args)
+            map(renderFrame, tasks)
+            stopWorker()
+        else:
+            pool = multiprocessing.Pool(processes, startWorker, init_args)
+            try:
+                pool.map(renderFrame, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        
+        if frames_filename:
+            return np.array(np.memmap(frames_filename, np.uint8, 'r', shape=(len(matrices), viewer.height, viewer.width, 3)))
+        return filenames
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def turntable(centre, num_frames, axis=(0,1,0)):
+    """ Return a list of matrices that rotate a scene once around an axis through centre in num_frames steps. """
+    
+    return [wf.rotateAboutVector(centre, axis, 2 * np.pi * i / num_frames) for i in range(num_frames)]
@@ -0,0 +1,103 @@
+""" Time the stages of drawing scenes built from basicShapes and print the results as JSON.
+    Scenes are drawn with a headless viewer so no window is needed.
+    
+    Usage: python benchmark.py [--repeats N] [--scenes name ...] [--output file] """
+
+import argparse
+import json
+import os
+import timeit
+import numpy as np
+
+# Stop pygame printing a banner into the JSON output
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import wireframe as wf
+import wireframeDisplay as wd
+import basicShapes as shape
+
+WIDTH, HEIGHT = 600, 400
+
+def cuboids():
+    return [('cube%d' % i, shape.Cuboid((20 + 55*(i % 10), 20 + 36*(i / 10), 20*i), (30,20,40))) for i in range(100)]
+
+def instancedCuboids():
+    template = shape.Cuboid((0,0,0), (30,20,40))
+    matrices = [wf.translationMatrix(20 + 55*(i % 10), 20 + 36*(i / 10), 20*i) for i in range(100)]
+    return [('cubes', wf.InstancedWireframe(template, matrices))]
+
+def spheroid(resolution):
+    def build():
+        # Unit spheroids are cached, so clear them to time making the spheroid rather than copying it
+        shape.spheroid_templates.clear()
+        return [('sphere', shape.Spheroid((300,200,20), (160,160,160), resolution=resolution))]
+    return build
+
+def grid():
+    return [('grid', shape.HorizontalGrid((20,400,0), (10,10), (56,56)))]
+
+def landscape():
+    # Use a fixed seed so every run times the same landscape
+    return [('landscape', shape.FractalLandscape(origin=(100,300,0), iterations=5, rng=0))]
+
+SCENES = [('cuboids', cuboids),
+          ('instanced-cuboids', instancedCuboids),
+          ('spheroid-10', spheroid(10)),
+          ('spheroid-26', spheroid(26)),
+          ('spheroid-52', spheroid(52)),
+          ('grid', grid),
+          ('landscape', landscape)]
+
+def timeStage(function, repeats):
+    """ Call function repeats times and return the mean and minimum time taken in ms. """
+    
+    times = []
+    for _ in range(repeats):
+        start = timeit.default_timer()
+        function()
+        times.append(1000 * (timeit.default_timer() - start))
+    return {'mean_ms': sum(times) / len(times), 'min_ms': min(times)}
+
+def benchmarkScene(build, repeats):
+    """ Return a dictionary of the time taken to build, transform, sort and display a scene. """
+    
+    results = {'build': timeStage(build, repeats)}
+    
+    viewer = wd.WireframeViewer(WIDTH, HEIGHT, headless=True)
+    for name, wireframe in build():
+        viewer.addWireframe(name, wireframe)
+    
+    # Transforms are applied when nodes are read, so read them to include the cost
+    matrix = wf.rotateAboutVector(viewer.findCentre(), (1,1,0), np.pi/64)
+    def transform():
+        viewer.transform(matrix)
+        for wireframe in viewer.wireframes.values():
+            wireframe.nodes
+    
+    results['transform'] = timeStage(transform, repeats)
+    results['sortedFaces'] = timeStage(lambda: viewer.faceOrder(viewer.face_depth), repeats)
+    results['display'] = timeStage(lambda: viewer.display(force=True), repeats)
+    results['fps'] = 1000 / results['display']['mean_ms']
+    
+    results['nodes'] = sum(wireframe.num_nodes for wireframe in viewer.wireframes.values())
+    results['edges'] = sum(wireframe.num_edges for wireframe in viewer.wireframes.values())
+    results['faces'] = sum(len(wireframe.face_colours) for wireframe in viewer.wireframes.values())
+    return results
+
+def runBenchmarks(scenes=None, repeats=10):
+    """ Return a dictionary mapping scene names to their benchmark results. """
+    
+    return dict((name, benchmarkScene(build, repeats)) for name, build in SCENES if scenes is None or name in scenes)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=10, help="number of times to time each stage")
+    parser.add_argument('--scenes', nargs='+', choices=[name for name, _ in SCENES], help="scenes to benchmark (default: all)")
+    parser.add_argument('--output', help="file to write the JSON results to (default: print them)")
+    args = parser.parse_args()
+    
+    results = json.dumps(runBenchmarks(args.scenes, args.repeats), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(results)
+    else:
+        print results
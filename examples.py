@@ -1,8 +1,10 @@
 import math
+import pygame
 import numpy as np
 import wireframe as wf
 import wireframeDisplay as wd
 import basicShapes as shape
+import terrain
 
 def testWireframe():
     """ Example of how to create wireframes node by node, and by using the basicShape module.
@@ -90,19 +92,67 @@ def testSurfaceDisplayWithSphere():
     viewer.addWireframe('sphere', shape.Spheroid((300,200, 20), (160,160,160), resolution=resolution))
 
     # Colour ball
-    faces = viewer.wireframes['sphere'].faces
+    sphere = viewer.wireframes['sphere']
     for i in range(resolution/4):
-        for j in range(resolution*2-4):
-            f = i*(resolution*4-8) +j
-            faces[f][1][1] = 0
-            faces[f][1][2] = 0
+        f = i*(resolution*4-8)
+        sphere.setFaceColours((255,0,0), slice(f, f+resolution*2-4))
         
     # Colour with lattitude
-    #for (face, colour) in faces[::2]:
-    #    colour[1] = 0
-    #    colour[2] = 0
+    #sphere.setFaceColours((255,0,0), slice(None, None, 2))
     
-    print "Create a sphere with %d faces." % len(viewer.wireframes['sphere'].faces)
+    print "Create a sphere with %d faces." % len(sphere.face_colours)
+    viewer.displayEdges = False
+    viewer.run()
+    
+def testLevelOfDetail():
+    """ Create a row of spheres that shrink into the distance, each drawn at a resolution to suit its size on screen. """
+    
+    viewer = wd.WireframeViewer(600, 400)
+    viewer.perspective = 300.
+    for i in range(8):
+        viewer.addWireframe('sphere%d' % i, shape.SpheroidLOD((60 + 70*i, 200, 250*i), (60,60,60)))
+    viewer.displayEdges = False
+    viewer.run()
+    
+def testStreamingTerrain():
+    """ Create an endless fractal landscape, generated in chunks as the up and down keys move over it. """
+    
+    viewer = wd.WireframeViewer(600, 400)
+    viewer.perspective = 300.
+    viewer.addTerrain('ground', terrain.StreamingTerrain(origin=(0,300,0), dimensions=(200,200), seed=1))
+    
+    wd.key_to_function[pygame.K_UP]   = (lambda x: x.transform(wf.translationMatrix(dz=-20)))
+    wd.key_to_function[pygame.K_DOWN] = (lambda x: x.transform(wf.translationMatrix(dz= 20)))
+    viewer.run()
+
+def testInstances():
+    """ Create a grid of 500 cubes which share one set of edges and faces, each with its own colour. """
+    
+    viewer = wd.WireframeViewer(600, 400)
+    positions = [(30 + 28*(i % 20), 40 + 14*(i / 20), 10*(i % 7)) for i in range(500)]
+    colours = [(50 + 8*(i % 25), 100, 250 - 8*(i % 25)) for i in range(500)]
+    cubes = wf.InstancedWireframe(shape.Cuboid((0,0,0), (10,10,10)), [wf.translationMatrix(*p) for p in positions], colours)
+    viewer.addWireframe('cubes', cubes)
+    viewer.displayEdges = False
+    viewer.run()
+
+def testDepthBuffer():
+    """ Create a cuboid that passes through a sphere, drawn with a depth buffer so they meet where they intersect. """
+    
+    viewer = wd.WireframeViewer(600, 400)
+    viewer.addWireframe('cube', shape.Cuboid((150,200,40), (200,60,100)))
+    viewer.addWireframe('sphere', shape.Spheroid((300,230,90), (100,100,100), resolution=30))
+    viewer.renderer = 'zbuffer'
+    viewer.displayEdges = False
+    viewer.run()
+
+def testSmoothShading():
+    """ Create a sphere lit with the normal at each node, so its shading is blended across its faces. """
+    
+    viewer = wd.WireframeViewer(600, 400)
+    viewer.addWireframe('sphere', shape.Spheroid((300,200,20), (160,160,160), resolution=26))
+    viewer.light.transform(wf.rotateXMatrix(0.6))
+    viewer.shading = 'smooth'
     viewer.displayEdges = False
     viewer.run()
     
@@ -114,6 +164,9 @@ def testWireframeDisplay3():
     viewer.addWireframe('cube1', shape.Cuboid((200,100,400), (20,30,40)))
     viewer.addWireframe('cube2', shape.Cuboid((100,360, 20), (10,40,20)))
     viewer.addWireframe('sphere', shape.Spheroid((250,300, 100), (20,30,40)))
+    
+    # The grid is the floor, so can be drawn once behind everything else
+    viewer.setStatic('grid')
     viewer.run()
 
 def chooseExample():
@@ -125,6 +178,11 @@ def chooseExample():
                 'testWireframeDisplay',
                 'testSurfaceDisplayWithCube',
                 'testSurfaceDisplayWithSphere',
+                'testLevelOfDetail',
+                'testStreamingTerrain',
+                'testInstances',
+                'testDepthBuffer',
+                'testSmoothShading',
                 'exit']
         
     makingChoice = True    
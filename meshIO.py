@@ -0,0 +1,178 @@
+""" Save and load wireframes in a compact binary format, and read wireframes from OBJ files.
+
+    A mesh file starts with MAGIC, then the length of a JSON header as a little-endian uint32, then the header.
+    The header lists the wireframes in the file, and for each of their arrays gives its dtype, shape and the
+    offset of its data from the start of the data section, which follows the header at a multiple of ALIGNMENT bytes.
+    Arrays are stored uncompressed in their in-memory layout, so they can be memory-mapped rather than read. """
+
+import itertools
+import json
+import re
+import struct
+import numpy as np
+import wireframe as wf
+
+MAGIC = b'WFMESH1\n'
+ALIGNMENT = 64
+
+# Arrays stored for each wireframe, and the types they are stored as
+ARRAY_TYPES = [('nodes', '<f8'), ('edges', '<i4'), ('face_nodes', '<i4'), ('face_offsets', '<i4'), ('face_colours', '|u1')]
+
+def align(offset):
+    """ Return the first multiple of ALIGNMENT at or after offset. """
+    
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def saveWireframes(filename, wireframes):
+    """ Save a list of (name, wireframe) pairs to a mesh file. Names must be strings or numbers.
+        Nodes are saved with any pending transform applied. """
+    
+    entries = []
+    arrays = []
+    offset = 0
+    for name, wireframe in wireframes:
+        entry = {'name': name, 'arrays': {}}
+        for key, dtype in ARRAY_TYPES:
+            array = np.ascontiguousarray(getattr(wireframe, key), dtype)
+            entry['arrays'][key] = {'dtype': dtype, 'shape': array.shape, 'offset': offset}
+            arrays.append((offset, array))
+            offset = align(offset + array.nbytes)
+        entries.append(entry)
+    
+    header = json.dumps({'wireframes': entries}).encode('utf-8')
+    data_start = align(len(MAGIC) + 4 + len(header))
+    
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for array_offset, array in arrays:
+            f.seek(data_start + array_offset)
+            array.tofile(f)
+        
+        # Pad the file so the last array's space is all there, even if it's empty
+        f.truncate(data_start + offset)
+
+def loadWireframes(filename, mmap_mode=None):
+    """ Return a list of (name, wireframe) pairs from a mesh file.
+        If mmap_mode is given, arrays are memory-mapped in that mode rather than read, so only the parts used
+        are loaded and processes that open the same file share its pages. Use 'c' for wireframes that will be
+        transformed or have nodes added, so changes are kept in memory, or 'r' for ones that won't change. """
+    
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a mesh file" % filename)
+        (header_length,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        data_start = align(len(MAGIC) + 4 + header_length)
+        
+        wireframes = []
+        for entry in header['wireframes']:
+            arrays = {}
+            for key, info in entry['arrays'].items():
+                shape = tuple(info['shape'])
+                dtype = np.dtype(str(info['dtype']))
+                count = int(np.prod(shape))
+                if mmap_mode and count:
+                    arrays[key] = np.memmap(filename, dtype, mmap_mode, data_start + info['offset'], shape)
+                else:
+                    f.seek(data_start + info['offset'])
+                    arrays[key] = np.fromfile(f, dtype, count).reshape(shape)
+            wireframes.append((entry['name'], wireframeFromArrays(arrays)))
+    
+    return wireframes
+
+def wireframeFromArrays(arrays):
+    """ Return a wireframe using a dictionary of arrays, without copying them. """
+    
+    wireframe = wf.Wireframe()
+    wireframe.setArrays(arrays['nodes'], arrays['edges'], arrays['face_nodes'], arrays['face_offsets'], arrays['face_colours'])
+    return wireframe
+
+def saveWireframe(filename, wireframe):
+    """ Save a single wireframe to a mesh file. """
+    
+    saveWireframes(filename, [('wireframe', wireframe)])
+
+def loadWireframe(filename, mmap_mode=None):
+    """ Return the first wireframe in a mesh file. """
+    
+    return loadWireframes(filename, mmap_mode)[0][1]
+
+def saveGroup(filename, group):
+    """ Save the wireframes of a WireframeGroup to a mesh file. """
+    
+    saveWireframes(filename, sorted(group.wireframes.items()))
+
+def loadGroup(filename, mmap_mode=None):
+    """ Return a WireframeGroup of the wireframes in a mesh file. """
+    
+    group = wf.WireframeGroup()
+    for name, wireframe in loadWireframes(filename, mmap_mode):
+        group.addWireframe(name, wireframe)
+    return group
+
+def readOBJ(filename, colour=(255,255,255), block_size=2**16):
+    """ Return a wireframe of the vertices (v) and faces (f) in an OBJ file, ignoring any other lines.
+        The file is read block_size lines at a time, and each block's numbers are parsed by NumPy
+        into arrays that double in size as they fill, so no Python object is made for each number. """
+    
+    nodes = np.zeros((0,3))
+    face_nodes = np.zeros(0, np.int32)
+    face_sizes = np.zeros(0, np.int32)
+    num_nodes = num_face_nodes = num_faces = 0
+    
+    with open(filename) as f:
+        while True:
+            lines = list(itertools.islice(f, block_size))
+            if not lines:
+                break
+            
+            # Split the keyword from the rest of each line, which can be separated by any whitespace
+            words = [line.split(None, 1) + ['', ''] for line in lines]
+            keywords = [w[0] for w in words]
+            rests = [w[1] for w in words]
+            
+            # Vertices in the block before each line, for resolving negative face indices
+            is_vertex = np.fromiter((keyword == 'v' for keyword in keywords), bool, len(lines))
+            vertices_before = num_nodes + np.cumsum(is_vertex) - is_vertex
+            
+            vertices = parseVertices([rest for rest, vertex in zip(rests, is_vertex) if vertex])
+            nodes = wf.reserve(nodes, num_nodes + len(vertices))
+            nodes[num_nodes:num_nodes+len(vertices)] = vertices
+            num_nodes += len(vertices)
+            
+            is_face = np.fromiter((keyword == 'f' for keyword in keywords), bool, len(lines))
+            if not is_face.any():
+                continue
+            
+            # Keep the vertex index from each v/vt/vn reference
+            faces = [re.sub(r'/\S*', '', rests[i]) for i in np.flatnonzero(is_face)]
+            sizes = np.fromiter((len(face.split()) for face in faces), np.int32, len(faces))
+            indices = np.fromstring(' '.join(faces), dtype=np.int32, sep=' ')
+            indices = np.where(indices < 0, indices + np.repeat(vertices_before[is_face], sizes), indices - 1)
+            
+            face_nodes = wf.reserve(face_nodes, num_face_nodes + len(indices))
+            face_nodes[num_face_nodes:num_face_nodes+len(indices)] = indices
+            num_face_nodes += len(indices)
+            face_sizes = wf.reserve(face_sizes, num_faces + len(sizes))
+            face_sizes[num_faces:num_faces+len(sizes)] = sizes
+            num_faces += len(sizes)
+    
+    # Faces with indices of 0, or outside the vertices, are dropped by addPackedFaces
+    wireframe = wf.Wireframe(nodes[:num_nodes])
+    wireframe.addPackedFaces(face_nodes[:num_face_nodes], face_sizes[:num_faces], colour)
+    return wireframe
+
+def parseVertices(lines):
+    """ Return an (N, 3) array of the first three numbers on each line. """
+    
+    if not lines:
+        return np.zeros((0,3))
+    
+    # Parse all the lines at once if they have the same number of values, as they usually do
+    width = len(lines[0].split())
+    values = np.fromstring(' '.join(lines), dtype=float, sep=' ')
+    if len(values) == width * len(lines) and width >= 3:
+        return values.reshape(-1, width)[:,:3]
+    return np.array([line.split()[:3] for line in lines], dtype=float)
@@ -0,0 +1,146 @@
+""" Draw triangles and lines into NumPy colour and depth buffers, keeping the nearest triangle at each pixel.
+    Buffers are indexed [x, y], like the arrays of pygame.surfarray. """
+
+import numpy as np
+
+def edgeFunction(a, b, x, y):
+    """ Return twice the signed area of the triangles from points a to b to (x, y).
+        a and b are arrays of points broadcast against the arrays of coordinates x and y. """
+    
+    return (b[...,0] - a[...,0]) * (y - a[...,1]) - (b[...,1] - a[...,1]) * (x - a[...,0])
+
+def rasterize(colour_buffer, depth_buffer, points, depths, colours, max_pixels=2**18):
+    """ Draw triangles into a (W, H, 3) colour buffer wherever they are nearer than the (W, H) depth buffer, and update it.
+        points is a (T, 3, 2) array of the triangles' corners on screen, depths a (T, 3) array of their depths,
+        which should vary linearly across the screen, with lower depths nearer, and colours either a (T, 3) array
+        or a (T, 3, 3) array of the colour at each corner, which are blended across the triangle.
+        Triangles are put in buckets by the size of their bounding boxes, rounded up to a power of 2, and each bucket
+        is tested against a grid of pixels the size of its boxes, at most max_pixels pixels at a time. """
+    
+    (width, height) = depth_buffer.shape
+    if len(points) == 0:
+        return
+    
+    # The pixels in each triangle's bounding box, clipped to the buffer
+    low = np.maximum(np.ceil(points.min(axis=1)), 0).astype(int)
+    high = np.minimum(np.floor(points.max(axis=1)), (width - 1, height - 1)).astype(int)
+    sizes = high - low + 1
+    
+    (a, b, c) = (points[:,0], points[:,1], points[:,2])
+    area = edgeFunction(a, b, c[:,0], c[:,1])
+    drawable = (sizes > 0).all(axis=1) & (area != 0)
+    
+    buckets = 2 ** np.ceil(np.log2(np.maximum(sizes, 1))).astype(int)
+    keys = buckets[:,0] * (2 * max(width, height)) + buckets[:,1]
+    for key in np.unique(keys[drawable]):
+        triangles = np.flatnonzero(drawable & (keys == key))
+        (bucket_width, bucket_height) = buckets[triangles[0]]
+        step = max(1, max_pixels // (bucket_width * bucket_height))
+        for start in range(0, len(triangles), step):
+            fillTriangles(colour_buffer, depth_buffer, triangles[start:start+step], bucket_width, bucket_height,
+                          low, high, points, area, depths, colours)
+
+def fillTriangles(colour_buffer, depth_buffer, triangles, bucket_width, bucket_height, low, high, points, area, depths, colours):
+    """ Draw the triangles with the given indices, whose bounding boxes fit in bucket_width by bucket_height pixels. """
+    
+    x = low[triangles,0,np.newaxis,np.newaxis] + np.arange(bucket_width)[:,np.newaxis]
+    y = low[triangles,1,np.newaxis,np.newaxis] + np.arange(bucket_height)
+    corners = points[triangles,:,np.newaxis,np.newaxis,:]
+    (a, b, c) = (corners[:,0], corners[:,1], corners[:,2])
+    
+    # The edge functions, divided by the area, are the barycentric coordinates of each pixel
+    inverse_area = 1.0 / area[triangles,np.newaxis,np.newaxis]
+    weight_a = edgeFunction(b, c, x, y) * inverse_area
+    weight_b = edgeFunction(c, a, x, y) * inverse_area
+    weight_c = 1 - weight_a - weight_b
+    inside = ((weight_a >= 0) & (weight_b >= 0) & (weight_c >= 0) &
+              (x <= high[triangles,0,np.newaxis,np.newaxis]) & (y <= high[triangles,1,np.newaxis,np.newaxis]))
+    
+    (k, i, j) = np.nonzero(inside)
+    triangle_depths = depths[triangles,:,np.newaxis,np.newaxis]
+    z = (weight_a * triangle_depths[:,0] + weight_b * triangle_depths[:,1] + weight_c * triangle_depths[:,2])[inside]
+    pixels = (low[triangles[k],0] + i) * depth_buffer.shape[1] + low[triangles[k],1] + j
+    
+    # Keep the nearest fragment at each pixel, then only where it's nearer than what's already drawn
+    order = np.lexsort((z, pixels))
+    first = np.ones(len(order), bool)
+    first[1:] = pixels[order[1:]] != pixels[order[:-1]]
+    nearest = order[first]
+    nearer = nearest[z[nearest] < depth_buffer.ravel()[pixels[nearest]]]
+    
+    (px, py) = np.divmod(pixels[nearer], depth_buffer.shape[1])
+    depth_buffer[px, py] = z[nearer]
+    if colours.ndim == 2:
+        colour_buffer[px, py] = colours[triangles[k[nearer]]]
+    else:
+        corner_colours = colours[triangles[k[nearer]]]
+        weights = np.column_stack((weight_a[inside][nearer], weight_b[inside][nearer], weight_c[inside][nearer]))
+        colour_buffer[px, py] = (weights[:,:,np.newaxis] * corner_colours).sum(axis=1)
+
+def rasterizeLines(colour_buffer, depth_buffer, points, depths, colours, max_pixels=2**18):
+    """ Draw lines one pixel wide into a (W, H, 3) colour buffer where they aren't hidden by what's in the (W, H) depth buffer.
+        points is an (L, 2, 2) array of the ends of the lines on screen, depths an (L, 2) array of their depths,
+        with lower depths nearer, and colours an (L, 3) array. Lines are clipped to the buffer and drawn at a point
+        for each pixel along their longer axis. A point is drawn if it is no further than the furthest depth
+        in the 3x3 pixels around it, so the edges of faces aren't hidden by the faces themselves.
+        The depth buffer isn't changed. Lines are drawn in batches of at most about max_pixels points. """
+    
+    (width, height) = depth_buffer.shape
+    if len(points) == 0:
+        return
+    
+    # Clip each line to the buffer by finding the range of its parameter, from 0 at its start to 1 at its end, on screen
+    (a, b) = (points[:,0], points[:,1])
+    direction = b - a
+    low = np.zeros(len(points))
+    high = np.ones(len(points))
+    for axis, size in enumerate((width, height)):
+        d = direction[:,axis]
+        flat = d == 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t1 = (-0.5 - a[:,axis]) / d
+            t2 = (size - 0.5 - a[:,axis]) / d
+        low = np.where(flat, low, np.maximum(low, np.minimum(t1, t2)))
+        high = np.where(flat, high, np.minimum(high, np.maximum(t1, t2)))
+        outside = flat & ((a[:,axis] < -0.5) | (a[:,axis] > size - 0.5))
+        high[outside] = -1
+    
+    drawable = np.flatnonzero(low <= high)
+    if len(drawable) == 0:
+        return
+    
+    (low, high) = (low[drawable], high[drawable])
+    starts = a[drawable] + low[:,np.newaxis] * direction[drawable]
+    ends = a[drawable] + high[:,np.newaxis] * direction[drawable]
+    depth_change = depths[drawable,1] - depths[drawable,0]
+    start_depths = depths[drawable,0] + low * depth_change
+    end_depths = depths[drawable,0] + high * depth_change
+    lengths = np.ceil(np.abs(ends - starts).max(axis=1)).astype(int) + 1
+    
+    step = max(1, max_pixels // lengths.max())
+    for start in range(0, len(drawable), step):
+        batch = slice(start, start + step)
+        drawLines(colour_buffer, depth_buffer, starts[batch], ends[batch], start_depths[batch], end_depths[batch],
+                  lengths[batch], colours[drawable[batch]])
+
+def drawLines(colour_buffer, depth_buffer, starts, ends, start_depths, end_depths, lengths, colours):
+    """ Draw lines, already clipped to the buffer, with a point for each of the given number of pixels along each. """
+    
+    (width, height) = depth_buffer.shape
+    lines = np.repeat(np.arange(len(lengths)), lengths)
+    steps = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    t = steps / np.maximum(lengths - 1, 1).astype(float)[lines]
+    
+    position = starts[lines] + t[:,np.newaxis] * (ends - starts)[lines]
+    px = np.clip(np.rint(position[:,0]).astype(int), 0, width - 1)
+    py = np.clip(np.rint(position[:,1]).astype(int), 0, height - 1)
+    z = start_depths[lines] + t * (end_depths - start_depths)[lines]
+    
+    furthest = np.empty(len(z))
+    furthest[:] = -np.inf
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            furthest = np.maximum(furthest, depth_buffer[np.clip(px + dx, 0, width - 1), np.clip(py + dy, 0, height - 1)])
+    
+    visible = z <= furthest
+    colour_buffer[px[visible], py[visible]] = colours[lines[visible]]
@@ -0,0 +1,232 @@
+""" A bounding volume hierarchy over the wireframes of a group, for picking and spatial queries. """
+
+import heapq
+import numpy as np
+
+def rayTriangles(origin, direction, v0, v1, v2):
+    """ Return the distance along a ray to each of the triangles with corners v0, v1 and v2, given as (T, 3) arrays,
+        measured in multiples of direction. Triangles the ray misses get a distance of infinity. """
+    
+    e1 = v1 - v0
+    e2 = v2 - v0
+    p = np.cross(direction, e2)
+    det = (e1 * p).sum(axis=1)
+    
+    # Rays parallel to a triangle miss it
+    parallel = np.abs(det) < 1e-12
+    inverse = 1.0 / np.where(parallel, 1, det)
+    
+    s = origin - v0
+    u = (s * p).sum(axis=1) * inverse
+    q = np.cross(s, e1)
+    v = np.dot(q, direction) * inverse
+    t = (e2 * q).sum(axis=1) * inverse
+    
+    hit = ~parallel & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0)
+    return np.where(hit, t, np.inf)
+
+def rayBox(origin, direction, box):
+    """ Return the distance along a ray to where it enters a (2, 3) box, or infinity if it misses. """
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t1 = (box[0] - origin) / direction
+        t2 = (box[1] - origin) / direction
+    
+    # Rays parallel to a pair of faces only hit if they start between them
+    parallel = direction == 0
+    inside = (origin >= box[0]) & (origin <= box[1])
+    near = np.where(parallel, np.where(inside, -np.inf, np.inf), np.minimum(t1, t2)).max()
+    far = np.where(parallel, np.where(inside, np.inf, -np.inf), np.maximum(t1, t2)).min()
+    
+    if near > far or far < 0:
+        return np.inf
+    return max(near, 0)
+
+def boxDistance(point, boxes):
+    """ Return the distance from a point to each of an (N, 2, 3) array of boxes, which is 0 for points inside. """
+    
+    gaps = np.maximum(boxes[:,0] - point, 0) + np.maximum(point - boxes[:,1], 0)
+    return np.sqrt((gaps**2).sum(axis=1))
+
+class BoundingVolumeHierarchy:
+    """ A binary tree of boxes over the wireframes of a group.
+        Each leaf holds up to leaf_size wireframes, and each node's box contains the boxes of the nodes below it.
+        Nodes are numbered so that parents come before their children. """
+    
+    def __init__(self, group, leaf_size=4):
+        self.group = group
+        self.leaf_size = leaf_size
+        
+        # Set when wireframes are added (rebuild) or moved (refit)
+        self.stale = False
+        self.moved = False
+        self.build()
+    
+    def build(self):
+        """ Build the tree from the current bounding boxes of the group's wireframes.
+            Each node's wireframes are split at the median along the axis in which their centres are most spread out. """
+        
+        self.names = [name for name, wireframe in self.group.wireframes.items() if wireframe.num_nodes]
+        self.leaf_boxes = self.wireframeBoxes()
+        centres = self.leaf_boxes.mean(axis=1)
+        
+        self.order = np.arange(len(self.names))
+        self.children = []
+        self.ranges = []
+        self.depths = []
+        
+        def addNode(start, end, depth):
+            node = len(self.children)
+            self.children.append([-1, -1])
+            self.ranges.append((start, end))
+            self.depths.append(depth)
+            
+            if end - start > self.leaf_size:
+                indices = self.order[start:end]
+                axis = np.ptp(centres[indices], axis=0).argmax()
+                self.order[start:end] = indices[np.argsort(centres[indices,axis], kind='mergesort')]
+                middle = (start + end) / 2
+                self.children[node] = [addNode(start, middle, depth+1), addNode(middle, end, depth+1)]
+            return node
+        
+        addNode(0, len(self.names), 0)
+        self.children = np.array(self.children)
+        self.ranges = np.array(self.ranges)
+        self.depths = np.array(self.depths)
+        self.boxes = np.zeros((len(self.children), 2, 3))
+        
+        self.stale = False
+        self.refit()
+    
+    def wireframeBoxes(self):
+        """ Return an (M, 2, 3) array of the bounding boxes of the wireframes in the tree. """
+        
+        return np.array([self.group.wireframes[name].bounds() for name in self.names]).reshape(-1, 2, 3)
+    
+    def refit(self):
+        """ Update the boxes of the tree from the wireframes' bounding boxes, without changing its structure.
+            Leaves are updated first, then each level of nodes above them. """
+        
+        self.leaf_boxes = self.wireframeBoxes()
+        self.moved = False
+        if len(self.names) == 0:
+            self.boxes[:] = 0
+            return
+        
+        leaves = np.flatnonzero(self.children[:,0] < 0)
+        boxes = self.leaf_boxes[self.order]
+        starts = self.ranges[leaves,0]
+        self.boxes[leaves,0] = np.minimum.reduceat(boxes[:,0], starts)
+        self.boxes[leaves,1] = np.maximum.reduceat(boxes[:,1], starts)
+        
+        for depth in range(self.depths.max() - 1, -1, -1):
+            nodes = np.flatnonzero((self.depths == depth) & (self.children[:,0] >= 0))
+            (left, right) = self.children[nodes].T
+            self.boxes[nodes,0] = np.minimum(self.boxes[left,0], self.boxes[right,0])
+            self.boxes[nodes,1] = np.maximum(self.boxes[left,1], self.boxes[right,1])
+    
+    def update(self):
+        """ Rebuild or refit the tree if the group has changed since it was last built or refitted. """
+        
+        if self.stale or set(self.names) != set(name for name, wireframe in self.group.wireframes.items() if wireframe.num_nodes):
+            self.build()
+        elif self.moved:
+            self.refit()
+    
+    def leafWireframes(self, node):
+        """ Return the indices into self.names of the wireframes in a leaf. """
+        
+        (start, end) = self.ranges[node]
+        return self.order[start:end]
+    
+    def boxQuery(self, min_values, max_values):
+        """ Return the names of the wireframes whose bounding boxes overlap the box from min_values to max_values. """
+        
+        self.update()
+        if len(self.names) == 0:
+            return []
+        
+        found = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            box = self.boxes[node]
+            if (box[1] < min_values).any() or (box[0] > max_values).any():
+                continue
+            
+            if self.children[node,0] < 0:
+                indices = self.leafWireframes(node)
+                boxes = self.leaf_boxes[indices]
+                overlap = ((boxes[:,1] >= min_values) & (boxes[:,0] <= max_values)).all(axis=1)
+                found.extend(self.names[i] for i in indices[overlap])
+            else:
+                stack.extend(self.children[node])
+        return found
+    
+    def nearest(self, point):
+        """ Return the name of the wireframe with the node nearest to a point, and the distance to it.
+            Nodes are searched in order of the distance to their boxes, stopping when no box could hold a nearer node. """
+        
+        self.update()
+        point = np.asarray(point, dtype=float)
+        best = (None, np.inf)
+        if len(self.names) == 0:
+            return best
+        
+        queue = [(boxDistance(point, self.boxes[:1])[0], 0)]
+        while queue:
+            (distance, node) = heapq.heappop(queue)
+            if distance >= best[1]:
+                break
+            
+            if self.children[node,0] < 0:
+                for i in self.leafWireframes(node):
+                    nodes = self.group.wireframes[self.names[i]].nodes[:,:3]
+                    distance = np.sqrt(((nodes - point)**2).sum(axis=1)).min()
+                    if distance < best[1]:
+                        best = (self.names[i], distance)
+            else:
+                children = self.children[node]
+                for child, distance in zip(children, boxDistance(point, self.boxes[children])):
+                    heapq.heappush(queue, (distance, child))
+        return best
+    
+    def pick(self, origin, direction):
+        """ Return the name of the first wireframe hit by a ray, and the distance along it in multiples of direction.
+            Wireframes with faces are hit where the ray meets a face; others where it enters their bounding box. """
+        
+        self.update()
+        origin = np.asarray(origin, dtype=float)
+        direction = np.asarray(direction, dtype=float)
+        best = (None, np.inf)
+        if len(self.names) == 0:
+            return best
+        
+        queue = [(rayBox(origin, direction, self.boxes[0]), 0)]
+        while queue:
+            (distance, node) = heapq.heappop(queue)
+            if distance >= best[1]:
+                break
+            
+            if self.children[node,0] < 0:
+                for i in self.leafWireframes(node):
+                    distance = self.rayWireframe(origin, direction, self.names[i])
+                    if distance < best[1]:
+                        best = (self.names[i], distance)
+            else:
+                for child in self.children[node]:
+                    distance = rayBox(origin, direction, self.boxes[child])
+                    if distance < np.inf:
+                        heapq.heappush(queue, (distance, child))
+        return best
+    
+    def rayWireframe(self, origin, direction, name):
+        """ Return the distance along a ray to a wireframe's nearest face, or to its bounding box if it has no faces. """
+        
+        wireframe = self.group.wireframes[name]
+        if len(wireframe.face_colours) == 0:
+            return rayBox(origin, direction, wireframe.bounds())
+        
+        (triangles, _) = wireframe.triangles()
+        nodes = wireframe.nodes[:,:3]
+        return rayTriangles(origin, direction, nodes[triangles[:,0]], nodes[triangles[:,1]], nodes[triangles[:,2]]).min()
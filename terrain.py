@@ -0,0 +1,141 @@
+""" Endless terrain made of square chunks of fractal landscape, generated when they come near the viewer. """
+
+import collections
+import numpy as np
+import wireframe as wf
+import basicShapes as shape
+
+# Numbers to tell apart the random number streams for corners, edges and the insides of chunks
+CORNER, X_EDGE, Z_EDGE, INSIDE = range(4)
+
+def randomStream(seed, kind, i, j):
+    """ Return a RandomState that depends only on the terrain seed, the kind of stream and its grid position. """
+    
+    return np.random.RandomState([seed % 2**32, kind, i % 2**32, j % 2**32])
+
+class StreamingTerrain(wf.WireframeGroup):
+    """ A grid of fractal landscape chunks, each dimensions wide, in which only the chunks within
+        view_distance chunks of the eye are in self.wireframes, keyed by their (i, j) grid position.
+        Chunks are generated from the seed when first needed, so the terrain is the same however it's explored.
+        Recently used chunks are kept in an LRU cache until they use more than memory_budget bytes,
+        counting the size of each chunk when it's generated. """
+    
+    def __init__(self, origin=(0,0,0), dimensions=(400,400), iterations=4, height=40, seed=0,
+                 view_distance=2, memory_budget=64*2**20, faces=False, colour=(255,255,255)):
+        wf.WireframeGroup.__init__(self)
+        self.origin = np.array(origin, dtype=float)
+        self.dimensions = dimensions
+        self.iterations = iterations
+        self.height = height
+        self.seed = seed
+        self.view_distance = view_distance
+        self.memory_budget = memory_budget
+        self.faces = faces
+        self.colour = colour
+        
+        # Transforms of the whole terrain, applied to each chunk as it becomes active
+        self.matrix = np.identity(4)
+        self.cache = collections.OrderedDict()
+        self.chunk_memory = {}
+        self.memory = 0
+        self.topology = None
+    
+    def displacements(self, stream, iteration, size):
+        """ Return 'size' random height displacements for an iteration of midpoint displacement. """
+        
+        return stream.uniform(-0.5, 0.5, size) * self.height/2**(iteration*0.8)
+    
+    def chunkHeights(self, i, j):
+        """ Return the array of heights for chunk (i, j).
+            Corner and edge heights come from random streams shared with the neighbouring chunks, so chunks meet seamlessly. """
+        
+        corners = [[randomStream(self.seed, CORNER, i+di, j+dj) for di in (0,1)] for dj in (0,1)]
+        edges = {'top':    randomStream(self.seed, X_EDGE, i, j),
+                 'bottom': randomStream(self.seed, X_EDGE, i, j+1),
+                 'left':   randomStream(self.seed, Z_EDGE, i, j),
+                 'right':  randomStream(self.seed, Z_EDGE, i+1, j)}
+        inside = randomStream(self.seed, INSIDE, i, j)
+        
+        heights = np.zeros((2,2))
+        for n in range(self.iterations):
+            heights = shape.subdivide(heights)
+            size = len(heights)
+            
+            displacement = np.empty((size, size))
+            displacement[1:-1,1:-1] = self.displacements(inside, n, (size-2, size-2))
+            displacement[0,1:-1] = self.displacements(edges['top'], n, size-2)
+            displacement[-1,1:-1] = self.displacements(edges['bottom'], n, size-2)
+            displacement[1:-1,0] = self.displacements(edges['left'], n, size-2)
+            displacement[1:-1,-1] = self.displacements(edges['right'], n, size-2)
+            for dj in (0,1):
+                for di in (0,1):
+                    displacement[-dj,-di] = self.displacements(corners[dj][di], n, 1)[0]
+            
+            heights += displacement
+        
+        return heights
+    
+    def chunk(self, key):
+        """ Return the chunk wireframe at grid position key, generating it if it isn't cached,
+            and mark it as the most recently used. """
+        
+        if key in self.cache:
+            wireframe = self.cache.pop(key)
+        else:
+            (i, j) = key
+            (dx, dz) = self.dimensions
+            origin = self.origin + (i*dx, 0, j*dz)
+            heights = self.chunkHeights(i, j)
+            
+            # Every chunk has the same edges and faces, so they're found once, from the first chunk, and shared
+            if self.topology is None:
+                self.topology = shape.HeightMap(origin, self.dimensions, heights, self.faces, self.colour)
+            topology = self.topology
+            wireframe = wf.Wireframe()
+            wireframe.setArrays(shape.heightMapNodes(origin, self.dimensions, heights), topology.edges,
+                                topology.face_nodes, topology.face_offsets, topology.face_colours.copy())
+            self.chunk_memory[key] = chunkMemory(wireframe)
+            self.memory += self.chunk_memory[key]
+        
+        self.cache[key] = wireframe
+        return wireframe
+    
+    def evict(self):
+        """ Remove the least recently used inactive chunks from the cache until it fits in the memory budget. """
+        
+        for key in list(self.cache):
+            if self.memory <= self.memory_budget:
+                break
+            if key not in self.wireframes:
+                del self.cache[key]
+                self.memory -= self.chunk_memory.pop(key)
+    
+    def updateChunks(self, eye):
+        """ Make the chunks within view_distance of the chunk below the point eye active.
+            eye is in the current coordinates, which self.matrix maps the terrain into. """
+        
+        (x, _, z, _) = np.dot(np.hstack((eye, 1)), np.linalg.inv(self.matrix))
+        (dx, dz) = self.dimensions
+        i = int(np.floor((x - self.origin[0]) / dx))
+        j = int(np.floor((z - self.origin[2]) / dz))
+        
+        r = self.view_distance
+        keys = [(i+di, j+dj) for di in range(-r, r+1) for dj in range(-r, r+1)]
+        
+        active = {}
+        for key in keys:
+            active[key] = self.chunk(key)
+            if key not in self.wireframes:
+                active[key].setMatrix(self.matrix)
+        
+        self.wireframes = active
+        self.evict()
+    
+    def transform(self, matrix):
+        self.matrix = np.dot(self.matrix, matrix)
+        wf.WireframeGroup.transform(self, matrix)
+
+def chunkMemory(wireframe):
+    """ Return the number of bytes used by a chunk's own arrays. Its edges and faces are shared with every other chunk, so aren't counted. """
+    
+    return wireframe.nodes.nbytes + wireframe.face_colours.nbytes
@@ -1,22 +1,26 @@
 import wireframe as wf
 import wireframeDisplay as wd
+import basicShapes as shape
 
 class AnimatedWireframe(wf.Wireframe):
-    def update(self):
-        self.translate([0,1,0])
+    # Speed in pixels per second
+    speed = 60
 
-ball = wf.getSpheroid((200,200,300), (30,30,30), 16)
+    def update(self, dt):
+        self.transform(wf.translationMatrix(dy=self.speed*dt))
+
+ball = shape.Spheroid((200,200,300), (30,30,30), 16)
 animated_ball = AnimatedWireframe()
-animated_ball.nodes = ball.nodes
-animated_ball.edges = ball.edges
+animated_ball.nodes = ball.nodes.copy()
+animated_ball.addEdges(ball.edges)
 
 width, height = 600, 400
 viewer = wd.WireframeViewer(width, height)
-viewer.addWireframe('floor', wf.getHorizontalGrid((0,height,0), (50,50), (12,12)))
+viewer.addWireframe('floor', shape.HorizontalGrid((0,height,0), (50,50), (12,12)))
 viewer.addWireframe('ball', animated_ball)
 
 # Eye starts at (width/2, height/2, 0). Move to (width/2, height-50, 0)
-viewer.translate([0,-150,0])
+viewer.transform(wf.translationMatrix(dy=-150))
 
 # Change depending on screen size and now much the eye can fit in view
 field_of_view = 0.25
@@ -24,4 +28,4 @@ viewer.scale(1/field_of_view)
 
 #viewer.perspective = False
 
-viewer.run()
\ No newline at end of file
+viewer.run()
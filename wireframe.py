@@ -1,4 +1,6 @@
+import itertools
 import numpy as np
+import spatial
 
 def translationMatrix(dx=0, dy=0, dz=0):
     """ Return matrix for translation along vector (dx, dy, dz). """
@@ -73,44 +75,394 @@ def rotateAboutVector((cx,cy,cz), (x,y,z), radians):
     
     return matrix
 
-class Wireframe:
-    """ An array of vectors in R3 and list of edges connecting them. """
+def reserve(array, size):
+    """ Return array if it has at least 'size' rows, otherwise a copy with at least double the rows.
+        Rows past the original length are left uninitialised. """
+    
+    if len(array) >= size:
+        return array
+    
+    grown = np.empty((max(size, 2*len(array)),) + array.shape[1:], array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+def normalMatrix(matrix):
+    """ Return the 3x3 matrix that transforms the normals of faces whose nodes are transformed by a 4x4 matrix,
+        or an (M, 3, 3) array of them for an (M, 4, 4) array of matrices. Vectors are rows, as for nodes.
+        This is the cofactor matrix of the upper left 3x3 part, A, which equals det(A) inv(A).T but exists
+        even when A is singular, so normals keep pointing out of the same side of their faces but need normalising. """
+    
+    a = np.asarray(matrix)[...,:3,:3]
+    return np.stack((np.cross(a[...,1,:], a[...,2,:]), np.cross(a[...,2,:], a[...,0,:]), np.cross(a[...,0,:], a[...,1,:])), axis=-2)
+
+def normalise(vectors):
+    """ Return an array of the vectors scaled to unit length, leaving zero vectors as they are. """
+    
+    lengths = np.sqrt((vectors**2).sum(axis=-1))
+    return vectors / np.where(lengths == 0, 1, lengths)[...,np.newaxis]
+
+def findNormals(nodes, face_nodes, face_offsets):
+    """ Return an (F, 3) array of the unit normals of faces, from the cross product of the vectors from the first node
+        of each face to its second and third nodes. Faces with fewer than three nodes get a normal of zero. """
+    
+    last = np.maximum(face_offsets[1:] - 1, 0)
+    corners = face_nodes[np.minimum(face_offsets[:-1,np.newaxis] + np.arange(3), last[:,np.newaxis])]
+    (a, b, c) = (nodes[corners[:,0],:3], nodes[corners[:,1],:3], nodes[corners[:,2],:3])
+    return normalise(np.cross(b - a, c - a))
+
+def edgeKeys(edges):
+    """ Return an int64 key for each edge of an (E, 2) array, with the first node in the high 32 bits. """
+    
+    return (edges[:,0].astype(np.int64) << 32) | edges[:,1]
+
+def depthOrder(depths):
+    """ Return the indices that sort an array of z-coordinates from furthest to nearest.
+        Objects with lower z-coordinates are closer to the viewer. """
+    
+    return np.argsort(-depths, kind='mergesort')
+
+class Wireframe(object):
+    """ An array of vectors in R3 and list of edges connecting them.
+        Faces are stored as a flat array of node indices, face_nodes, split by face_offsets,
+        so face i uses the nodes face_nodes[face_offsets[i]:face_offsets[i+1]] and has colour face_colours[i]. """
     
     def __init__(self, nodes=None):
-        self.nodes = np.zeros((0,4))
-        self.edges = []
-        self.faces = []
+        self._nodes = np.zeros((0,4))
+        self.num_nodes = 0
+        self.matrix = np.identity(4)
+        self._identity = True
+        self._transformed = None
+        self._bounds = None
+        self._world_bounds = None
+        
+        # The packed group whose node array self._nodes is a view onto, if any, and its matrix when this wireframe last caught up with it
+        self._group = None
+        self._group_matrix = None
+        self._group_version = None
+        
+        self._version = 0
+        self._edges = np.zeros((0,2), np.int32)
+        self.num_edges = 0
+        self._edge_keys = np.zeros(0, np.int64)
+        self.face_nodes = np.zeros(0, np.int32)
+        self.face_offsets = np.zeros(1, np.int32)
+        self.face_colours = np.zeros((0,3), np.uint8)
+        self._face_edges = None
         
-        if nodes:
+        # Unit normals of the faces and nodes before self.matrix is applied, and cached with it applied.
+        # Face normals are found when faces are added, then transformed along with the nodes.
+        # When the stored nodes are transformed, the normal matrix is kept in _normal_matrix until the normals are next read.
+        self._face_normals = np.zeros((0,3))
+        self._node_normals = None
+        self._normal_matrix = None
+        self._world_face_normals = None
+        self._world_node_normals = None
+        
+        if nodes is not None:
             self.addNodes(nodes)
 
+    @property
+    def nodes(self):
+        """ An (N, 4) array of the nodes as homogeneous coordinates, with self.matrix applied.
+            The result is cached until the next transform. If no transform is pending,
+            this is a view onto the start of a buffer with room to add more nodes.
+            Call applyTransform before editing nodes in place. """
+        
+        if self._identity:
+            return self._nodes[:self.num_nodes]
+        
+        if self._transformed is None:
+            self._transformed = np.dot(self._nodes[:self.num_nodes], self.matrix)
+        return self._transformed
+    
+    @nodes.setter
+    def nodes(self, node_array):
+        self.leaveGroup()
+        self._nodes = node_array
+        self.num_nodes = len(node_array)
+        self.matrix = np.identity(4)
+        self._identity = True
+        self._transformed = None
+        self.nodesChanged()
+    
     def addNodes(self, node_array):
-        """ Append 1s to a list of 3-tuples and add to self.nodes. """
+        """ Append 1s to a list of 3-tuples or an (N, 3) array and add to self.nodes.
+            The node buffer doubles in size when it's full, so nodes can be added one at a time cheaply. """
+        
+        # New nodes are in the current coordinates, so fix the existing nodes in them too
+        self.leaveGroup()
+        self.applyTransform()
+        
+        node_array = np.asarray(node_array, dtype=float).reshape(-1, 3)
+        start = self.num_nodes
+        end = start + len(node_array)
+        
+        self._nodes = reserve(self._nodes, end)
+        self._nodes[start:end,:3] = node_array
+        self._nodes[start:end,3] = 1
+        self.num_nodes = end
+        
+        # Grow the bounding box rather than recalculating it
+        if self._bounds is not None and len(node_array):
+            self._bounds = np.vstack((np.minimum(self._bounds[0], node_array.min(axis=0)),
+                                      np.maximum(self._bounds[1], node_array.max(axis=0))))
+        self._world_bounds = None
+        self.version += 1
+    
+    @property
+    def version(self):
+        """ Counts changes that could change how the wireframe looks, so viewers can tell when to redraw it. """
+        
+        self.applyGroupTransform()
+        return self._version
+    
+    @version.setter
+    def version(self, version):
+        self._version = version
+    
+    @property
+    def edges(self):
+        """ An (E, 2) array of node indices, with the lower index of each edge first. """
         
-        ones_added = np.hstack((node_array, np.ones((len(node_array),1))))
-        self.nodes = np.vstack((self.nodes, ones_added))
+        return self._edges[:self.num_edges]
     
     def addEdges(self, edge_list):
-        """ Add edges as a list of 2-tuples. """
+        """ Add edges as a list of 2-tuples or an (E, 2) array.
+            Edges are stored with the lower node index first, so (a, b) and (b, a) are the same edge
+            and are only added once. """
         
-        # Is it better to use a for loop or generate a long list then add it?
         # Should raise exception if edge value > len(self.nodes)
-        self.edges += [edge for edge in edge_list if edge not in self.edges]
+        edges = np.sort(np.asarray(edge_list, np.int32).reshape(-1,2), axis=1)
+        
+        # Key each edge by a single integer to find duplicates, against a sorted array of the existing edges' keys
+        keys = edgeKeys(edges)
+        _, first = np.unique(keys, return_index=True)
+        first.sort()
+        if len(self._edge_keys) != self.num_edges:
+            # Edges set directly, such as when loading a file, only have their keys found when needed
+            self._edge_keys = np.sort(edgeKeys(self.edges))
+        
+        existing = self._edge_keys
+        found = np.zeros(len(first), bool)
+        if len(existing):
+            found = existing[np.minimum(np.searchsorted(existing, keys[first]), len(existing) - 1)] == keys[first]
+        new_edges = first[~found]
+        new_keys = np.sort(keys[new_edges])
+        self._edge_keys = np.insert(existing, np.searchsorted(existing, new_keys), new_keys)
+        
+        start = self.num_edges
+        end = start + len(new_edges)
+        self._edges = reserve(self._edges, end)
+        self._edges[start:end] = edges[new_edges]
+        self.num_edges = end
+        self.version += 1
 
     def addFaces(self, face_list, face_colour=(255,255,255)):
-        for node_list in face_list:
-            num_nodes = len(node_list)
-            if all((node < len(self.nodes) for node in node_list)):
-                #self.faces.append([self.nodes[node] for node in node_list])
-                self.faces.append((node_list, np.array(face_colour, np.uint8)))
-                self.addEdges([(node_list[n-1], node_list[n]) for n in range(num_nodes)])
+        """ Add faces as a list of node index tuples, or an (F, k) array of node indices.
+            face_colour is either a single colour or an (F, 3) array with a colour for each face.
+            Faces that use nodes that don't exist are ignored. """
+        
+        if isinstance(face_list, np.ndarray):
+            sizes = np.repeat(face_list.shape[1], len(face_list))
+            flat = face_list.astype(np.int32).ravel()
+        else:
+            sizes = np.array([len(node_list) for node_list in face_list], np.int32)
+            flat = np.fromiter(itertools.chain.from_iterable(face_list), np.int32, sizes.sum())
+        
+        self.addPackedFaces(flat, sizes, face_colour)
+    
+    def addPackedFaces(self, flat, sizes, face_colour=(255,255,255)):
+        """ Add faces given as a flat array of node indices and an array of the number of nodes in each face.
+            face_colour is either a single colour or an (F, 3) array with a colour for each face.
+            Faces that use nodes that don't exist are ignored. """
+        
+        flat = np.asarray(flat, np.int32)
+        sizes = np.asarray(sizes, np.int32)
+        colours = np.empty((len(sizes),3), np.uint8)
+        colours[:] = face_colour
+        
+        if len(sizes) == 0:
+            return
+        
+        # Drop faces with negative nodes or nodes beyond the end of self.nodes
+        starts = np.cumsum(sizes) - sizes
+        valid = (np.minimum.reduceat(flat, starts) >= 0) & (np.maximum.reduceat(flat, starts) < self.num_nodes)
+        if not valid.all():
+            flat = flat[np.repeat(valid, sizes)]
+            sizes = sizes[valid]
+            colours = colours[valid]
+            starts = np.cumsum(sizes) - sizes
+        
+        self.applyNormalMatrix()
+        if self._face_normals is not None and len(self._face_normals) == len(self.face_colours):
+            offsets = np.hstack((0, np.cumsum(sizes)))
+            self._face_normals = np.vstack((self._face_normals, findNormals(self._nodes[:self.num_nodes], flat, offsets)))
+        self._node_normals = self._world_face_normals = self._world_node_normals = None
+        
+        self.face_offsets = np.hstack((self.face_offsets, self.face_offsets[-1] + np.cumsum(sizes, dtype=np.int32)))
+        self.face_nodes = np.hstack((self.face_nodes, flat))
+        self.face_colours = np.vstack((self.face_colours, colours))
+        self.version += 1
+        
+        # Add an edge from each node to the previous node in its face
+        previous = np.arange(len(flat)) - 1
+        previous[starts] = starts + sizes - 1
+        self.addEdges(np.column_stack((flat[previous], flat)))
+    
+    @property
+    def faces(self):
+        """ A list of (node_tuple, colour) pairs for each face.
+            Each colour is a view into face_colours; use setFaceColours to change them, so viewers redraw. """
+        
+        offsets = self.face_offsets
+        return [(tuple(self.face_nodes[offsets[i]:offsets[i+1]]), self.face_colours[i]) for i in range(len(self.face_colours))]
+    
+    def setFaceColours(self, colours, faces=None):
+        """ Set the colour of the faces given by an array of indices, a mask or a slice, or of all faces if faces is None.
+            colours is a single colour or an array with a colour for each face. Colours are changed in place. """
+        
+        if faces is None:
+            faces = slice(None)
+        self.face_colours[faces] = colours
+        self.coloursChanged()
+    
+    def coloursChanged(self):
+        """ Call after editing face_colours in place, so viewers know to redraw the wireframe. """
+        
+        self.version += 1
+    
+    def triangles(self):
+        """ Split each face into a fan of triangles from its first node.
+            Return a (T, 3) array of the triangles' node indices and an array of the face each came from. """
+        
+        counts = (np.diff(self.face_offsets) - 2).clip(min=0)
+        faces = np.repeat(np.arange(len(counts)), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        first = self.face_offsets[faces]
+        
+        triangles = np.column_stack((self.face_nodes[first], self.face_nodes[first+within+1], self.face_nodes[first+within+2]))
+        return triangles, faces
+    
+    def faceNormals(self):
+        """ Return an (F, 3) array of the unit normal of each face, with self.matrix applied.
+            Normals are only found from the nodes again after the nodes are replaced or edited in place;
+            otherwise they are transformed by the normal matrix of self.matrix. """
+        
+        self.applyNormalMatrix()
+        if self._face_normals is None or len(self._face_normals) != len(self.face_colours):
+            self._face_normals = findNormals(self._nodes[:self.num_nodes], self.face_nodes, self.face_offsets)
+            self._node_normals = self._world_face_normals = self._world_node_normals = None
+        
+        if self._world_face_normals is None:
+            if self._identity:
+                self._world_face_normals = self._face_normals
+            else:
+                self._world_face_normals = normalise(np.dot(self._face_normals, normalMatrix(self.matrix)))
+        return self._world_face_normals
+    
+    def nodeNormals(self):
+        """ Return an (N, 3) array of unit normals at each node, the average of the normals of the faces that use it,
+            with self.matrix applied. Nodes not used by any face get a normal of zero. """
+        
+        self.faceNormals()
+        if self._node_normals is None:
+            normals = np.repeat(self._face_normals, np.diff(self.face_offsets), axis=0)
+            sums = [np.bincount(self.face_nodes, normals[:,i], self.num_nodes) for i in range(3)]
+            self._node_normals = normalise(np.column_stack(sums))
+        
+        if self._world_node_normals is None:
+            if self._identity:
+                self._world_node_normals = self._node_normals
+            else:
+                self._world_node_normals = normalise(np.dot(self._node_normals, normalMatrix(self.matrix)))
+        return self._world_node_normals
+    
+    def applyNormalMatrix(self):
+        """ Transform the stored normals by the normal matrix of any transforms applied to the stored nodes since they were last read. """
+        
+        self.applyGroupTransform()
+        if self._normal_matrix is not None:
+            if self._face_normals is not None:
+                self._face_normals = normalise(np.dot(self._face_normals, self._normal_matrix))
+            if self._node_normals is not None:
+                self._node_normals = normalise(np.dot(self._node_normals, self._normal_matrix))
+            self._normal_matrix = None
+    
+    def faceEdges(self):
+        """ Return an array of the index into self.edges of each edge of each face, and an array of the face each belongs to.
+            The result is cached until the faces or edges are replaced. """
+        
+        cached = self._face_edges
+        if cached is None or cached[0] is not self.face_nodes or cached[1] is not self._edges or cached[2] != self.num_edges:
+            counts = np.diff(self.face_offsets)
+            faces = np.repeat(np.arange(len(counts)), counts)
+            
+            # Pair each node with the previous node in its face, as in addFaces
+            previous = np.arange(len(self.face_nodes)) - 1
+            previous[self.face_offsets[:-1][counts > 0]] = self.face_offsets[1:][counts > 0] - 1
+            pairs = np.sort(np.column_stack((self.face_nodes[previous], self.face_nodes)), axis=1)
+            
+            face_keys = edgeKeys(pairs)
+            edge_keys = edgeKeys(self.edges)
+            order = np.argsort(edge_keys)
+            edges = order[np.searchsorted(edge_keys, face_keys, sorter=order)]
+            self._face_edges = (self.face_nodes, self._edges, self.num_edges, edges, faces)
+        
+        return self._face_edges[3:]
+    
+    def setArrays(self, nodes, edges=None, face_nodes=None, face_offsets=None, face_colours=None,
+                  face_normals=None, node_normals=None, normal_matrix=None):
+        """ Replace the nodes, edges and faces with the given arrays, without copying them, and clear anything cached from the old ones.
+            nodes is an (N, 4) array of homogeneous coordinates and edges must have the lower node index of each edge first.
+            Arrays may be shared with other wireframes, as adding nodes, edges or faces replaces them rather than writing into them.
+            Face and node normals can be given if they're known, with normal_matrix to transform them by when they're next read. """
+        
+        self.leaveGroup()
+        self._nodes = nodes
+        self.num_nodes = len(nodes)
+        self.matrix = np.identity(4)
+        self._identity = True
+        self._transformed = None
+        self._bounds = None
+        self._world_bounds = None
+        
+        self._edges = np.zeros((0,2), np.int32) if edges is None else edges
+        self.num_edges = len(self._edges)
+        self._edge_keys = np.zeros(0, np.int64)
+        self.face_nodes = np.zeros(0, np.int32) if face_nodes is None else face_nodes
+        self.face_offsets = np.zeros(1, np.int32) if face_offsets is None else face_offsets
+        self.face_colours = np.zeros((0,3), np.uint8) if face_colours is None else face_colours
+        self._face_edges = None
+        
+        self._face_normals = face_normals
+        self._node_normals = node_normals
+        self._normal_matrix = normal_matrix
+        self._world_face_normals = self._world_node_normals = None
+        self.version += 1
+    
+    def copy(self, matrix=None):
+        """ Return a new Wireframe with a copy of this one's nodes, with its transform applied, edges and faces.
+            If matrix is given, the copy's nodes are transformed by it as well, and its normals are found by
+            transforming this wireframe's normals when they're next read, rather than from the nodes again.
+            The face node and offset arrays, normals and edge keys are shared, since they are replaced rather than changed. """
+        
+        if matrix is None:
+            (nodes, normal_matrix) = (self.nodes.copy(), None)
+        else:
+            (nodes, normal_matrix) = (np.dot(self.nodes, matrix), normalMatrix(matrix))
+        
+        wireframe = Wireframe()
+        wireframe.setArrays(nodes, self.edges.copy(), self.face_nodes, self.face_offsets, self.face_colours.copy(),
+                            self.faceNormals(), normal_matrix=normal_matrix)
+        wireframe._edge_keys = self._edge_keys
+        return wireframe
     
     def output(self):
         if len(self.nodes) > 1:
             self.outputNodes()
-        if self.edges:
+        if self.num_edges:
             self.outputEdges()
-        if self.faces:
+        if len(self.face_colours):
             self.outputFaces()  
     
     def outputNodes(self):
@@ -125,36 +477,328 @@ class Wireframe:
             
     def outputFaces(self):
         print "\n --- Faces --- "
-        for i, nodes in enumerate(self.faces):
+        for i, (nodes, _) in enumerate(self.faces):
             print "   %d: (%s)" % (i, ", ".join(['%d' % n for n in nodes]))
     
     def transform(self, transformation_matrix):
-        """ Apply a transformation defined by a transformation matrix. """
+        """ Apply a transformation defined by a transformation matrix.
+            The matrix is combined with self.matrix and only applied to the nodes when they are next read,
+            except in a packed group, where the nodes are transformed in place so self.matrix stays the identity. """
+        
+        if self._group is not None:
+            nodes = self._nodes[:self.num_nodes]
+            nodes[:] = np.dot(nodes, transformation_matrix)
+            self.nodesChanged(transformation_matrix)
+            return
+        
+        self.matrix = np.dot(self.matrix, transformation_matrix)
+        self._identity = False
+        self._transformed = None
+        self._world_bounds = None
+        self._world_face_normals = self._world_node_normals = None
+        self.version += 1
+    
+    def setMatrix(self, matrix):
+        """ Replace self.matrix, so the nodes are transformed by matrix alone.
+            A wireframe in a packed group leaves it, as its nodes are no longer transformed in place. """
+        
+        self.leaveGroup()
+        self.matrix = np.array(matrix, dtype=float)
+        self._identity = False
+        self._transformed = None
+        self._world_bounds = None
+        self._world_face_normals = self._world_node_normals = None
+        self.version += 1
+    
+    def applyTransform(self):
+        """ Apply self.matrix to the stored nodes, in place, and reset it to the identity. """
         
-        self.nodes = np.dot(self.nodes, transformation_matrix)
+        if not self._identity:
+            matrix = self.matrix
+            self._nodes[:self.num_nodes] = self.nodes
+            self.matrix = np.identity(4)
+            self._identity = True
+            self._transformed = None
+            self.nodesChanged(matrix)
+    
+    def nodesChanged(self, matrix=None, normal_matrix=None):
+        """ Call after editing the stored nodes in place, to clear anything cached from them.
+            If the nodes were edited by transforming them with a matrix, passing it lets the normals be transformed
+            with it, when they are next read, rather than found from the nodes again.
+            normal_matrix can be given as well, if it's already known, to save finding it again. """
+        
+        self.applyGroupTransform()
+        self._bounds = None
+        self._world_bounds = None
+        self._world_face_normals = self._world_node_normals = None
+        
+        if matrix is None:
+            self._face_normals = self._node_normals = None
+            self._normal_matrix = None
+        else:
+            if normal_matrix is None:
+                normal_matrix = normalMatrix(matrix)
+            if self._normal_matrix is not None:
+                normal_matrix = np.dot(self._normal_matrix, normal_matrix)
+            self._normal_matrix = normal_matrix
+        self.version += 1
+    
+    def joinGroup(self, group, nodes):
+        """ Make the stored nodes nodes, a view onto the node array of the packed group, group, which has the same values.
+            Nothing cached from the nodes is cleared, since their values don't change. """
+        
+        self._nodes = nodes
+        self._group = group
+        self._group_matrix = group.packed_matrix
+        self._group_version = group.packed_version
+    
+    def leaveGroup(self):
+        """ Stop being part of a packed group, and mark the group to be packed again.
+            The stored nodes stay a view onto the group's old array until they're next replaced. """
+        
+        if self._group is not None:
+            self.applyGroupTransform()
+            self._group.stale = True
+            self._group = None
+    
+    def applyGroupTransform(self):
+        """ Catch up with the transforms of this wireframe's packed group since it last did.
+            The group transforms the nodes of all its wireframes in place, but only keeps the product of its transforms,
+            so each wireframe transforms its normals and clears its bounds when they're next read. """
+        
+        group = self._group
+        if group is not None and self._group_version != group.packed_version:
+            self._group_version = group.packed_version
+            try:
+                matrix = np.linalg.solve(self._group_matrix, group.packed_matrix)
+            except np.linalg.LinAlgError:
+                matrix = None
+            self._group_matrix = group.packed_matrix
+            self.nodesChanged(matrix)
+    
+    def bounds(self):
+        """ Return a (2, 3) array of the minimum and maximum x, y and z coordinates, or None if there are no nodes.
+            The box is cached. When a transform is pending, it is found from the 8 transformed corners
+            of the untransformed box, so can be larger than the true bounding box after a rotation. """
+        
+        if self.num_nodes == 0:
+            return None
+        
+        self.applyGroupTransform()
+        if self._bounds is None:
+            nodes = self._nodes[:self.num_nodes,:-1]
+            self._bounds = np.vstack((nodes.min(axis=0), nodes.max(axis=0)))
+        
+        if self._identity:
+            return self._bounds
+        
+        if self._world_bounds is None:
+            corners = np.ones((8,4))
+            corners[:,:3] = [(x,y,z) for x in self._bounds[:,0] for y in self._bounds[:,1] for z in self._bounds[:,2]]
+            corners = np.dot(corners, self.matrix)[:,:3]
+            self._world_bounds = np.vstack((corners.min(axis=0), corners.max(axis=0)))
+        return self._world_bounds
     
     def findCentre(self):
-        """ Find the spatial centre by finding the range of the x, y and z coordinates. """
-
-        min_values = self.nodes[:,:-1].min(axis=0)
-        max_values = self.nodes[:,:-1].max(axis=0)
+        """ Find the spatial centre from the bounding box of the x, y and z coordinates. """
+        
+        (min_values, max_values) = self.bounds()
         return 0.5*(min_values + max_values)
     
-    def sortedFaces(self):
-        return sorted(self.faces, key=lambda face: min(self.nodes[f][2] for f in face[0]))
+    def faceDepths(self, depth='min'):
+        """ Return an array of the 'min', 'max' or 'mean' z-coordinate of each face. """
+        
+        if len(self.face_colours) == 0:
+            return np.zeros(0)
+        
+        z = self.nodes[self.face_nodes,2]
+        starts = self.face_offsets[:-1]
+        if depth == 'min':
+            return np.minimum.reduceat(z, starts)
+        elif depth == 'max':
+            return np.maximum.reduceat(z, starts)
+        elif depth == 'mean':
+            return np.add.reduceat(z, starts) / np.diff(self.face_offsets)
+        raise ValueError("depth must be 'min', 'max' or 'mean', not %r" % depth)
     
-    def update(self):
-        """ Override this function to control wireframe behaviour. """
+    def edgeDepths(self, depth='min'):
+        """ Return an array of the 'min', 'max' or 'mean' z-coordinate of each edge. """
+        
+        z = self.nodes[self.edges,2]
+        if depth == 'min':
+            return z.min(axis=1)
+        elif depth == 'max':
+            return z.max(axis=1)
+        elif depth == 'mean':
+            return z.mean(axis=1)
+        raise ValueError("depth must be 'min', 'max' or 'mean', not %r" % depth)
+    
+    def faceOrder(self, depth='min'):
+        """ Return a permutation of the face indices that orders them from furthest to nearest,
+            which is the order to draw them so nearer faces are drawn over further ones. """
+        
+        return depthOrder(self.faceDepths(depth))
+    
+    def sortedFaces(self, depth='min'):
+        """ Return a list of (node_tuple, colour) pairs from the furthest to the nearest face. """
+        
+        faces = self.faces
+        return [faces[i] for i in self.faceOrder(depth)]
+    
+    def update(self, dt):
+        """ Override this function to control wireframe behaviour.
+            dt is the time in seconds since the last update. """
         pass
 
+class InstancedWireframe(Wireframe):
+    """ Many copies of a template wireframe, each transformed by its own matrix from an (M, 4, 4) array, instance_matrices.
+        The nodes of all the instances are found with one batched product when read, so transforming the whole
+        wireframe only changes self.matrix, however many instances there are. Instance i uses the N template nodes
+        from i*N, and its faces can have their own colour. Only the nodes, normals and bounds are found from the template
+        without copying it: the edges, faces and face colours are the template's tiled M times, offset to each instance's nodes,
+        as viewers and spatial indexes read them like any other wireframe's, so they use M times the template's memory.
+        They are rebuilt when instances are added; call instancesChanged after changing the template's topology or face colours,
+        or nodesChanged after editing instance_matrices in place. Packed groups leave instanced wireframes out of their arrays. """
+    
+    def __init__(self, template, matrices=None, colours=None):
+        Wireframe.__init__(self)
+        self.template = template
+        self.instance_matrices = np.zeros((0,4,4))
+        self.instance_colours = np.zeros((0,3), np.uint8)
+        self.instance_coloured = np.zeros(0, bool)
+        
+        if matrices is not None:
+            self.addInstances(matrices, colours)
+    
+    @property
+    def nodes(self):
+        """ An (M*N, 4) array of the nodes of every instance, with its instance matrix and self.matrix applied. """
+        
+        if self._transformed is None:
+            matrices = np.dot(self.instance_matrices, self.matrix)
+            self._transformed = np.einsum('nj,mjk->mnk', self.template.nodes, matrices).reshape(-1, 4)
+        return self._transformed
+    
+    def addInstances(self, matrices, colours=None):
+        """ Add instances with an (M, 4, 4) array of matrices, in the current coordinates.
+            colours is either None, to use the template's face colours, a single colour or an (M, 3) array of colours. """
+        
+        self.applyTransform()
+        matrices = np.asarray(matrices, dtype=float).reshape(-1, 4, 4)
+        
+        new_colours = np.zeros((len(matrices),3), np.uint8)
+        if colours is not None:
+            new_colours[:] = colours
+        
+        self.instance_matrices = np.vstack((self.instance_matrices, matrices))
+        self.instance_colours = np.vstack((self.instance_colours, new_colours))
+        self.instance_coloured = np.hstack((self.instance_coloured, np.repeat(colours is not None, len(matrices))))
+        self.instancesChanged()
+    
+    def instancesChanged(self):
+        """ Rebuild the edges and faces of all the instances from the template's. """
+        
+        template = self.template
+        count = len(self.instance_matrices)
+        self.num_nodes = count * template.num_nodes
+        node_starts = np.arange(count, dtype=np.int32) * template.num_nodes
+        face_node_starts = np.arange(count, dtype=np.int32) * len(template.face_nodes)
+        
+        self._edges = (template.edges + node_starts[:,np.newaxis,np.newaxis]).reshape(-1, 2)
+        self.num_edges = len(self._edges)
+        self.face_nodes = (template.face_nodes + node_starts[:,np.newaxis]).ravel()
+        self.face_offsets = np.hstack(((template.face_offsets[:-1] + face_node_starts[:,np.newaxis]).ravel(),
+                                       np.array([len(self.face_nodes)], np.int32)))
+        
+        # Instances without colours of their own keep the template's face colours
+        num_faces = len(template.face_colours)
+        self.face_colours = np.tile(template.face_colours, (count, 1))
+        coloured = np.repeat(self.instance_coloured, num_faces)
+        self.face_colours[coloured] = np.repeat(self.instance_colours[self.instance_coloured], num_faces, axis=0)
+        
+        self.nodesChanged()
+    
+    def applyTransform(self):
+        """ Combine self.matrix with each of the instance matrices and reset it to the identity. """
+        
+        if not self._identity:
+            self.instance_matrices = np.dot(self.instance_matrices, self.matrix)
+            self.matrix = np.identity(4)
+            self._identity = True
+            self.nodesChanged()
+    
+    def nodesChanged(self, matrix=None, normal_matrix=None):
+        self._transformed = None
+        Wireframe.nodesChanged(self, matrix, normal_matrix)
+    
+    def faceNormals(self):
+        """ Return an (M*F, 3) array of the unit normals of the faces of every instance, from the template's. """
+        
+        if self._world_face_normals is None:
+            matrices = normalMatrix(np.dot(self.instance_matrices, self.matrix))
+            self._world_face_normals = normalise(np.einsum('fj,mjk->mfk', self.template.faceNormals(), matrices).reshape(-1, 3))
+        return self._world_face_normals
+    
+    def nodeNormals(self):
+        """ Return an (M*N, 3) array of the unit normals at the nodes of every instance, from the template's. """
+        
+        if self._world_node_normals is None:
+            matrices = normalMatrix(np.dot(self.instance_matrices, self.matrix))
+            self._world_node_normals = normalise(np.einsum('nj,mjk->mnk', self.template.nodeNormals(), matrices).reshape(-1, 3))
+        return self._world_node_normals
+    
+    def bounds(self):
+        """ Return a (2, 3) array of the minimum and maximum x, y and z coordinates, or None if there are no nodes.
+            The box is found from the corners of the template's bounding box in each instance, so is cached
+            and can be larger than the true bounding box when instances are rotated. """
+        
+        if self.num_nodes == 0:
+            return None
+        
+        if self._world_bounds is None:
+            box = self.template.bounds()
+            corners = np.ones((8,4))
+            corners[:,:3] = [(x,y,z) for x in box[:,0] for y in box[:,1] for z in box[:,2]]
+            corners = np.einsum('cj,mjk->mck', corners, np.dot(self.instance_matrices, self.matrix))[:,:,:3].reshape(-1, 3)
+            self._world_bounds = np.vstack((corners.min(axis=0), corners.max(axis=0)))
+        return self._world_bounds
+
 class WireframeGroup:
-    """ A dictionary of wireframes and methods to manipulate them all together. """
+    """ A dictionary of wireframes and methods to manipulate them all together.
+        A packed group keeps the nodes of all its wireframes in one array, self.nodes,
+        with each wireframe's nodes a view onto a slice of it, so the group can be transformed in one step. """
     
-    def __init__(self):
+    def __init__(self, packed=False):
         self.wireframes = {}
+        self.packed = packed
+        self.slices = {}
+        self.nodes = None
+        self.spatial_index = None
+        
+        # The wireframes whose nodes are in self.nodes, and the rest, which are transformed on their own.
+        # The group is stale, and needs packing again, after wireframes are added or a packed wireframe leaves.
+        self.packed_wireframes = []
+        self.unpacked_wireframes = []
+        self.stale = True
+        
+        # The product of the transforms since the group was packed, and a count of them,
+        # which packed wireframes compare with their own copies to catch up when they're next read
+        self.packed_matrix = np.identity(4)
+        self.packed_version = 0
     
     def addWireframe(self, name, wireframe):
         self.wireframes[name] = wireframe
+        self.stale = True
+        if self.spatial_index:
+            self.spatial_index.stale = True
+    
+    def buildSpatialIndex(self, leaf_size=4):
+        """ Build a bounding volume hierarchy over the wireframes for spatial queries.
+            It is refitted after the group's transform and update, and rebuilt after wireframes are added.
+            Call its refit method after moving wireframes individually. """
+        
+        self.spatial_index = spatial.BoundingVolumeHierarchy(self, leaf_size)
+        return self.spatial_index
     
     def output(self):
         for name, wireframe in self.wireframes.items():
@@ -171,18 +815,106 @@ class WireframeGroup:
             print name
             wireframe.outputEdges()
     
+    def packableNames(self):
+        """ Return the names of the wireframes that can be packed. Instanced wireframes find their nodes
+            from their instance matrices, so are left out of packing and transformed on their own. """
+        
+        return [name for name, wireframe in self.wireframes.items() if not isinstance(wireframe, InstancedWireframe)]
+    
+    def pack(self):
+        """ Copy the nodes of all the packable wireframes into a single array, self.nodes.
+            Each wireframe's nodes become a view onto a slice of it, and self.slices maps each name
+            to its (start, end) node indices. Edges, faces and face colours stay with each wireframe. """
+        
+        names = self.packableNames()
+        wireframes = [self.wireframes[name] for name in names]
+        for wireframe in self.packed_wireframes + wireframes:
+            wireframe.leaveGroup()
+        for wireframe in wireframes:
+            wireframe.applyTransform()
+        self.packed_matrix = np.identity(4)
+        
+        node_ends = np.cumsum([0] + [wireframe.num_nodes for wireframe in wireframes])
+        self.nodes = np.vstack([wireframe.nodes for wireframe in wireframes] + [np.zeros((0,4))])
+        
+        self.slices = {}
+        for i, (name, wireframe) in enumerate(zip(names, wireframes)):
+            wireframe.joinGroup(self, self.nodes[node_ends[i]:node_ends[i+1]])
+            self.slices[name] = (node_ends[i], node_ends[i+1])
+        
+        self.packed_wireframes = wireframes
+        self.unpacked_wireframes = [wireframe for name, wireframe in self.wireframes.items() if name not in self.slices]
+        self.stale = False
+    
+    def isPacked(self):
+        """ Return True if self.nodes is up to date with the wireframes.
+            Adding wireframes, or adding nodes to, replacing the nodes of or setting the matrix of a packed wireframe,
+            means the group needs packing again. Wireframes removed from self.wireframes are noticed by their number changing. """
+        
+        return not self.stale and len(self.wireframes) == len(self.packed_wireframes) + len(self.unpacked_wireframes)
+    
+    def packedNodes(self):
+        """ Return the group's node array, repacking first if necessary. """
+        
+        if not self.isPacked():
+            self.pack()
+        return self.nodes
+    
+    def bounds(self):
+        """ Return a (2, 3) array of the minimum and maximum x, y and z coordinates of all the wireframes,
+            or None if they have no nodes. """
+        
+        if self.packed:
+            nodes = self.packedNodes()
+            boxes = [wireframe.bounds() for wireframe in self.unpacked_wireframes]
+            if len(nodes):
+                boxes.append(np.vstack((nodes[:,:-1].min(axis=0), nodes[:,:-1].max(axis=0))))
+        else:
+            boxes = [wireframe.bounds() for wireframe in self.wireframes.values()]
+        
+        boxes = np.array([box for box in boxes if box is not None])
+        if len(boxes) == 0:
+            return None
+        return np.vstack((boxes[:,0].min(axis=0), boxes[:,1].max(axis=0)))
+    
     def findCentre(self):
-        """ Find the central point of all the wireframes. """
+        """ Find the central point of all the wireframes from their combined bounding box. """
         
-        # There may be a more efficient way to find the minimums for a group of wireframes
-        min_values = np.array([wireframe.nodes[:,:-1].min(axis=0) for wireframe in self.wireframes.values()]).min(axis=0)
-        max_values = np.array([wireframe.nodes[:,:-1].max(axis=0) for wireframe in self.wireframes.values()]).max(axis=0)
+        (min_values, max_values) = self.bounds()
         return 0.5*(min_values + max_values)
     
+    def faceOrder(self, depth='min'):
+        """ Order the faces of all the wireframes together from furthest to nearest.
+            Return a list of wireframe names and arrays of indices into that list and face indices, in drawing order. """
+        
+        names = self.wireframes.keys()
+        depths = [self.wireframes[name].faceDepths(depth) for name in names]
+        wireframe_indices = np.repeat(np.arange(len(names)), [len(d) for d in depths])
+        face_indices = np.hstack([np.arange(len(d)) for d in depths] + [np.zeros(0, int)])
+        
+        order = depthOrder(np.hstack(depths + [np.zeros(0)]))
+        return names, wireframe_indices[order], face_indices[order]
+    
     def transform(self, matrix):
-        for wireframe in self.wireframes.values():
-            wireframe.transform(matrix)
+        if self.spatial_index:
+            self.spatial_index.moved = True
+        
+        if self.packed:
+            nodes = self.packedNodes()
+            nodes[:] = np.dot(nodes, matrix)
+            self.packed_matrix = np.dot(self.packed_matrix, matrix)
+            self.packed_version += 1
+            for wireframe in self.unpacked_wireframes:
+                wireframe.transform(matrix)
+        else:
+            for wireframe in self.wireframes.values():
+                wireframe.transform(matrix)
 
-    def update(self):
+    def update(self, dt):
+        """ Update each wireframe, where dt is the time in seconds since the last update. """
+        
+        if self.spatial_index:
+            self.spatial_index.moved = True
+        
         for wireframe in self.wireframes.values():
-            wireframe.update()
\ No newline at end of file
+            wireframe.update(dt)
\ No newline at end of file
@@ -1,6 +1,8 @@
 import pygame, math
+import timeit
 import numpy as np
 import wireframe as wf
+import rasterizer
 
 # Radian rotated by a key event
 ROTATION_AMOUNT = np.pi/16
@@ -30,18 +32,76 @@ light_movement = {
     pygame.K_x:      (lambda x: x.transform(wf.rotateZMatrix( ROTATION_AMOUNT)))
 }
 
+# Statistics recorded for each frame, in the order they are displayed
+STATS = ['fps', 'culled_wireframes', 'visible_faces', 'culled_faces', 'events_ms', 'updates', 'update_ms', 'shade_ms', 'sort_ms', 'draw_ms']
+
+# Viewer attributes that change how the wireframes are drawn
+VIEW_SETTINGS = ['displayNodes', 'displayEdges', 'displayFaces', 'perspective', 'near_plane', 'far_plane', 'view_vector',
+                 'face_depth', 'renderer', 'shading', 'min_light', 'light_range', 'background', 'nodeRadius']
+
+def polylines(edges, groups=None):
+    """ Join an (E, 2) array of edges into runs in which each edge starts at the node the previous edge ends at,
+        reversing edges where that lets them join the edges next to them.
+        If groups, an array of a group for each edge, is given, edges in different groups aren't joined.
+        Return an array of the nodes along all the runs, one after another, and a list of the (start, end)
+        positions of each run in that array. """
+    
+    if len(edges) == 0:
+        return np.zeros(0, edges.dtype), []
+    
+    # The node each edge shares with the previous edge, if any
+    (first, second) = (edges[1:], edges[:-1])
+    shares_first = (second[:,0] == first[:,0]) | (second[:,0] == first[:,1])
+    shares_second = (second[:,1] == first[:,0]) | (second[:,1] == first[:,1])
+    shared = np.hstack((-1, np.where(shares_second, second[:,1], np.where(shares_first, second[:,0], -1))))
+    if groups is not None:
+        shared[1:][groups[1:] != groups[:-1]] = -1
+    
+    # An edge can't join both its neighbours at the same node, as it would have to start and end there
+    joins = shared >= 0
+    conflicts = np.zeros(len(edges), bool)
+    conflicts[2:] = joins[1:-1] & (shared[2:] == shared[1:-1])
+    joins &= ~conflicts
+    
+    # Edges that join the previous edge start at the shared node; edges that only join the next one end at its shared node
+    joins_next = np.append(joins[1:], False)
+    next_shared = np.append(shared[1:], -1)
+    starts_second = np.where(joins, edges[:,1] == shared, joins_next & (edges[:,0] == next_shared))
+    edges = np.where(starts_second[:,np.newaxis], edges[:,::-1], edges)
+    
+    breaks = np.flatnonzero(~joins[1:]) + 1
+    starts = np.hstack((0, breaks))
+    ends = np.hstack((breaks, len(edges)))
+    
+    # Each run is the first node of each of its edges followed by the last node of its last edge
+    path = np.insert(edges[:,0], ends, edges[ends-1,1])
+    offsets = np.arange(len(starts))
+    return path, np.column_stack((starts + offsets, ends + offsets + 1)).tolist()
+
 class WireframeViewer(wf.WireframeGroup):
-    """ A group of wireframes which can be displayed on a Pygame screen """
+    """ A group of wireframes which can be displayed on a Pygame screen.
+        A headless viewer draws to an in-memory surface instead of opening a window. """
     
-    def __init__(self, width, height, name="Wireframe Viewer"):
+    def __init__(self, width, height, name="Wireframe Viewer", headless=False):
         self.width = width
         self.height = height
+        self.headless = headless
         
-        self.screen = pygame.display.set_mode((width, height))
-        pygame.display.set_caption(name)
+        if headless:
+            self.screen = pygame.Surface((width, height))
+        else:
+            self.screen = pygame.display.set_mode((width, height))
+            pygame.display.set_caption(name)
         
-        self.wireframes = {}
+        wf.WireframeGroup.__init__(self)
+        self.terrains = {}
         self.wireframe_colours = {}
+        
+        # Names of wireframes and terrains drawn to a cached layer behind the others
+        self.static = set()
+        self.static_layer = None
+        self.static_state = None
+        self.drawn_state = None
         self.object_to_update = []
         
         self.displayNodes = False
@@ -49,9 +109,18 @@ class WireframeViewer(wf.WireframeGroup):
         self.displayFaces = True
         
         self.perspective = False #300.
+        self.near_plane = 1.0
+        self.far_plane = None
         self.eyeX = self.width/2
         self.eyeY = 100
         self.view_vector = np.array([0, 0, -1])
+        self.face_depth = 'min'
+        
+        # 'painter' draws faces sorted from far to near; 'zbuffer' draws them with a depth buffer
+        self.renderer = 'painter'
+        
+        # 'flat' shades each face one colour; 'smooth' blends the shading at each node, using the depth buffer
+        self.shading = 'flat'
         
         self.light = wf.Wireframe()
         self.light.addNodes([[0, -1, 0]])
@@ -65,12 +134,94 @@ class WireframeViewer(wf.WireframeGroup):
         self.nodeRadius = 4
         
         self.control = 0
+        
+        # Frame rate cap for run(); 0 means no cap
+        self.target_fps = 60
+        
+        # Wireframes are updated in fixed steps of time_step seconds, running at most max_updates steps a frame.
+        # interpolation is the fraction of a step that has passed since the last update, for drawing between steps.
+        # step_matrices maps the names of wireframes moved by the last step to their matrices before and after it,
+        # and their version after it.
+        self.time_step = 1.0 / 60
+        self.max_updates = 5
+        self.interpolation = 0
+        self.lag = 0
+        self.step_matrices = {}
+        
+        self.displayStats = False
+        self.statsColour = (250,250,100)
+        self.stats_callback = None
+        self.stats = dict((key, 0) for key in STATS)
     
     def addWireframe(self, name, wireframe):
-        self.wireframes[name] = wireframe
+        wf.WireframeGroup.addWireframe(self, name, wireframe)
         #   If colour is set to None, then wireframe is not displayed
         self.wireframe_colours[name] = (250,250,250)
     
+    def addTerrain(self, name, terrain):
+        """ Add a StreamingTerrain, whose chunks near the eye are drawn along with the wireframes. """
+        
+        self.terrains[name] = terrain
+        self.wireframe_colours[name] = (250,250,250)
+    
+    def setStatic(self, name, static=True):
+        """ Mark a wireframe or terrain as static, so it's drawn once to a cached layer and copied to the screen
+            each frame until it, or the view, changes. Static wireframes are drawn behind all the others,
+            so suit things like a floor grid that nothing passes behind. """
+        
+        if static:
+            self.static.add(name)
+        else:
+            self.static.discard(name)
+        self.drawn_state = None
+    
+    def sceneWireframes(self):
+        """ Return a list of (name, wireframe, colour) tuples for the wireframes and the active terrain chunks,
+            after updating which chunks are active. Terrain chunks have the name of their terrain. """
+        
+        scene = [(name, wireframe, self.wireframe_colours[name]) for name, wireframe in self.wireframes.items()]
+        for name, terrain in self.terrains.items():
+            terrain.updateChunks(self.eyePosition())
+            scene.extend((name, chunk, self.wireframe_colours[name]) for chunk in terrain.wireframes.values())
+        return scene
+    
+    def sceneState(self, names):
+        """ Return a tuple that changes when the view, the light or any of the named wireframes or terrains change.
+            Wireframes are tracked by their version, and terrains by their transformation matrix,
+            which with the view decides which chunks are active. """
+        
+        state = [repr(getattr(self, key)) for key in VIEW_SETTINGS]
+        state.append(self.light.version)
+        for name in sorted(names):
+            if name in self.wireframes:
+                state.append((name, id(self.wireframes[name]), self.wireframes[name].version, self.wireframe_colours[name]))
+            elif name in self.terrains:
+                state.append((name, id(self.terrains[name]), self.terrains[name].matrix.tostring(), self.wireframe_colours[name]))
+        return tuple(state)
+    
+    def transform(self, matrix):
+        wf.WireframeGroup.transform(self, matrix)
+        for terrain in self.terrains.values():
+            terrain.transform(matrix)
+
+    def bounds(self):
+        """ Return a (2, 3) array of the minimum and maximum x, y and z coordinates of the wireframes
+            and the active chunks of the terrains, or None if there are none. """
+        
+        boxes = [wf.WireframeGroup.bounds(self)] + [terrain.bounds() for terrain in self.terrains.values()]
+        boxes = np.array([box for box in boxes if box is not None])
+        if len(boxes) == 0:
+            return None
+        return np.vstack((boxes[:,0].min(axis=0), boxes[:,1].max(axis=0)))
+    
+    def findCentre(self):
+        """ Find the central point of the wireframes and terrains, or the centre of the screen if there are none. """
+        
+        bounds = self.bounds()
+        if bounds is None:
+            return np.array([self.width/2, self.height/2, 0])
+        return 0.5*(bounds[0] + bounds[1])
+
     def addWireframeGroup(self, wireframe_group):
         # Potential danger of overwriting names
         for name, wireframe in wireframe_group.wireframes.items():
@@ -97,73 +248,519 @@ class WireframeViewer(wf.WireframeGroup):
         rotation_matrix = np.dot(np.dot(translation_matrix1, rotation_matrix), translation_matrix2)
         self.transform(rotation_matrix)
 
-    def display(self):
-        self.screen.fill(self.background)
-        light = self.light.nodes[0][:3]
-        spectral_highlight = self.light.nodes[0][:3] + self.view_vector
-        spectral_highlight /= np.linalg.norm(spectral_highlight)
+    def projectNodes(self, nodes):
+        """ Return an (N, 2) array of the screen positions of the nodes
+            and a mask of the nodes in front of the near plane. """
+        
+        if not self.perspective:
+            return nodes[:,:2], np.ones(len(nodes), bool)
+        
+        in_front = nodes[:,2] > self.near_plane - self.perspective
+        centre = np.array([self.width/2, self.height/2])
+        
+        # Nodes behind the near plane get a depth of 1 to avoid dividing by zero; they shouldn't be drawn
+        z = self.perspective / np.where(in_front, self.perspective + nodes[:,2], self.perspective)
+        return centre + z[:,np.newaxis] * (nodes[:,:2] - centre), in_front
+    
+    def eyePosition(self):
+        """ Return the position of the eye, which with no perspective is taken to be at z=0. """
+        
+        return np.array([self.width/2, self.height/2, -self.perspective if self.perspective else 0])
+    
+    def screenSize(self, bounds):
+        """ Return the approximate size in pixels on screen of a bounding box, from its larger width or height. """
+        
+        (min_values, max_values) = bounds
+        size = (max_values[:2] - min_values[:2]).max()
+        
+        if self.perspective:
+            # Boxes reaching past the near plane could fill the screen
+            if min_values[2] <= self.near_plane - self.perspective:
+                return max(self.width, self.height)
+            size *= self.perspective / (self.perspective + min_values[2])
+        return size
+    
+    def onScreen(self, min_values, max_values):
+        """ Return a mask of the (N, 2) screen rectangles, given by their minimum and maximum corners, that overlap the screen. """
+        
+        return ((max_values[:,0] >= 0) & (min_values[:,0] <= self.width) &
+                (max_values[:,1] >= 0) & (min_values[:,1] <= self.height))
+    
+    def inView(self, wireframes):
+        """ Return a mask of the wireframes whose bounding boxes might be seen:
+            those that overlap the screen and, with perspective, are between the near and far planes.
+            far_plane, like near_plane, is a distance from the eye; None means there's no far plane. """
+        
+        boxes = [wireframe.bounds() for wireframe in wireframes]
+        in_view = np.array([box is not None for box in boxes], bool)
+        if not in_view.any():
+            return in_view
+        
+        # The 8 corners of each box
+        boxes = np.array([box for box in boxes if box is not None])
+        corner_index = np.array([(i,j,k) for i in (0,1) for j in (0,1) for k in (0,1)])
+        corners = boxes[:,corner_index,np.arange(3)]
+        
+        screen_corners, in_front = self.projectNodes(corners.reshape(-1,3))
+        screen_corners = screen_corners.reshape(-1,8,2)
+        visible = self.onScreen(screen_corners.min(axis=1), screen_corners.max(axis=1))
+        
+        if self.perspective:
+            in_front = in_front.reshape(-1,8)
+            
+            # Boxes partly behind the near plane can't be culled by their projection
+            visible |= ~in_front.all(axis=1)
+            visible &= in_front.any(axis=1)
+            if self.far_plane:
+                visible &= corners[:,:,2].min(axis=1) < self.far_plane - self.perspective
+        
+        in_view[in_view] = visible
+        return in_view
+    
+    def pick(self, x, y):
+        """ Return the name of the wireframe drawn at the screen position (x, y), or None if there isn't one.
+            Uses the group's spatial index, building it if necessary. """
+        
+        if self.spatial_index is None:
+            self.buildSpatialIndex()
+        
+        if self.perspective:
+            origin = self.eyePosition()
+            direction = (x - self.width/2, y - self.height/2, self.perspective)
+        else:
+            bounds = self.bounds()
+            if bounds is None:
+                return None
+            origin = (x, y, bounds[0,2] - 1)
+            direction = (0, 0, 1)
+        
+        return self.spatial_index.pick(origin, direction)[0]
+    
+    def shadeFaces(self, normals, positions, colours):
+        """ Return a mask of the faces that face the viewer and the shaded colours of those faces.
+            Faces are given as (F, 3) arrays of their unit normals, a point on each and their colours. """
+        
+        # Only shade faces that face us, which with perspective depends on the direction to the eye
+        if self.perspective:
+            towards_us = (normals * (self.eyePosition() - positions)).sum(axis=1) > 0
+        else:
+            towards_us = np.dot(normals, self.view_vector) > 0
+        
+        shades = self.lighting(normals[towards_us])[:,np.newaxis] * colours[towards_us]
+        return towards_us, shades
+    
+    def lighting(self, normals):
+        """ Return the brightness of surfaces with an (N, 3) array of unit normals.
+            Surfaces angled away from the light get the minimum light. """
+        
+        theta = np.dot(normals, self.light.nodes[0][:3]).clip(min=0)
+        return theta * self.light_range + self.min_light
+
+    def drawFaces(self, surface, wireframes, projected, edge_colours=None):
+        """ Draw the faces facing the viewer to surface, with the faces of all the wireframes sorted together by depth,
+            or with a depth buffer if self.renderer is 'zbuffer' or self.shading is 'smooth'.
+            projected is a list of the screen positions and in front masks from projectNodes for each wireframe.
+            If edge_colours, a list of the colour of each wireframe's edges, is given, the edges are drawn too,
+            so that nearer faces hide them: with the depth buffer, or else each edge of the faces drawn once,
+            straight after the last of its faces to be drawn, and other edges in depth order among the faces. Edges are only drawn if some wireframe has faces.
+            Return a list with a mask of the faces drawn for each wireframe, or None for wireframes without faces. """
+        
+        drawn = [None] * len(wireframes)
+        with_faces = [i for i, wireframe in enumerate(wireframes) if len(wireframe.face_colours)]
+        if not with_faces:
+            return drawn
+        
+        (all_wireframes, all_projected) = (wireframes, projected)
+        wireframes = [wireframes[i] for i in with_faces]
+        projected = [projected[i] for i in with_faces]
+        
+        start = timeit.default_timer()
+        face_indices = []
+        face_shades = []
+        
+        for i, wireframe in enumerate(wireframes):
+            in_front = projected[i][1]
+            
+            # Only faces with every node in front of the near plane, and some part on screen, can be drawn
+            starts = wireframe.face_offsets[:-1]
+            screen_nodes = projected[i][0][wireframe.face_nodes]
+            on_screen = self.onScreen(np.minimum.reduceat(screen_nodes, starts), np.maximum.reduceat(screen_nodes, starts))
+            faces = np.flatnonzero(np.logical_and.reduceat(in_front[wireframe.face_nodes], starts) & on_screen)
+            positions = wireframe.nodes[wireframe.face_nodes[wireframe.face_offsets[faces]],:3]
+            towards_us, shades = self.shadeFaces(wireframe.faceNormals()[faces], positions, wireframe.face_colours[faces])
+            faces = faces[towards_us]
+            
+            drawn[with_faces[i]] = np.zeros(len(wireframe.face_colours), bool)
+            drawn[with_faces[i]][faces] = True
+            face_indices.append(faces)
+            face_shades.append(shades)
+        
+        visible = sum(len(faces) for faces in face_indices)
+        self.stats['shade_ms'] += 1000 * (timeit.default_timer() - start)
+        self.stats['visible_faces'] += visible
+        self.stats['culled_faces'] += sum(len(wireframe.face_colours) for wireframe in wireframes) - visible
+        
+        if self.renderer == 'zbuffer' or self.shading == 'smooth':
+            lines = None
+            if edge_colours is not None:
+                lines = self.edgeLines(all_wireframes, all_projected, edge_colours, drawn)
+            self.rasterizeFaces(surface, wireframes, projected, face_indices, face_shades, lines)
+            return drawn
+        elif self.renderer != 'painter':
+            raise ValueError("renderer must be 'painter' or 'zbuffer', not %r" % self.renderer)
+        
+        # Sort the faces, then any edges not on a face, by depth, with each indexed by its wireframe and position
+        start = timeit.default_timer()
+        items = [(np.repeat(with_faces[i], len(faces)), faces, wireframe.faceDepths(self.face_depth)[faces])
+                 for i, (wireframe, faces) in enumerate(zip(wireframes, face_indices))]
+        if edge_colours is not None:
+            for i, (wireframe, (_, in_front)) in enumerate(zip(all_wireframes, all_projected)):
+                edges = np.flatnonzero(~self.faceEdgeMask(wireframe) & in_front[wireframe.edges].all(axis=1))
+                items.append((np.repeat(i, len(edges)), edges, wireframe.edgeDepths(self.face_depth)[edges]))
+        (item_wireframes, item_indices, item_depths) = [np.hstack([item[k] for item in items]) for k in range(3)]
+        order = wf.depthOrder(item_depths)
+        self.stats['sort_ms'] += 1000 * (timeit.default_timer() - start)
+        
+        # Split the drawing order into single faces and runs of edges from the same wireframe
+        face_shades = np.vstack(face_shades)
+        is_edge = order >= len(face_shades)
+        order_wireframes = item_wireframes[order]
+        new_run = np.ones(len(order), bool)
+        new_run[1:] = ~is_edge[1:] | ~is_edge[:-1] | (order_wireframes[1:] != order_wireframes[:-1])
+        run_starts = np.flatnonzero(new_run)
+        run_ends = np.append(run_starts[1:], len(order))
+        
+        # The polylines of the edges to draw after the face at each position in the drawing order
+        if edge_colours is not None:
+            (edge_points, edge_runs, run_positions) = self.faceEdgePolylines(wireframes, projected, face_indices, order)
+            run_bounds = np.searchsorted(run_positions, np.arange(len(order) + 1)).tolist()
+        
+        for first, last in zip(run_starts.tolist(), run_ends.tolist()):
+            w = order_wireframes[first]
+            wireframe = all_wireframes[w]
+            screen_nodes = all_projected[w][0]
+            if is_edge[first]:
+                self.drawPolylines(surface, wireframe.edges[item_indices[order[first:last]]], screen_nodes, edge_colours[w])
+            else:
+                f = order[first]
+                i = item_indices[f]
+                points = screen_nodes[wireframe.face_nodes[wireframe.face_offsets[i]:wireframe.face_offsets[i+1]]].tolist()
+                pygame.draw.polygon(surface, face_shades[f], points, 0)
+                if edge_colours is not None:
+                    for (start, end) in edge_runs[run_bounds[first]:run_bounds[first+1]]:
+                        pygame.draw.aalines(surface, edge_colours[w], False, edge_points[start:end])
+        
+        return drawn
+    
+    def faceEdgePolylines(self, wireframes, projected, face_indices, order):
+        """ Join the edges of the faces drawn into polylines, giving each edge to the last of its faces to be drawn,
+            since that face covers the others. face_indices is a list of arrays of the faces drawn of each wireframe,
+            numbered one after another in order, the drawing order.
+            Return a list of the screen points along all the polylines, a list of the (start, end) positions
+            of each polyline in that list, and an array of the position in order of the face each polyline is drawn after,
+            which is in increasing order. """
+        
+        position = np.empty(len(order), int)
+        position[order] = np.arange(len(order))
+        
+        # Number the nodes, edges, faces and face-node slots of all the wireframes one after another
+        topology = [(wireframe.edges, wireframe.face_offsets[:-1]) + wireframe.faceEdges() for wireframe in wireframes]
+        counts = np.array([(len(screen_nodes), len(edges), len(starts), len(slot_edges))
+                           for (screen_nodes, _), (edges, starts, slot_edges, _) in zip(projected, topology)])
+        (node_starts, edge_starts, face_starts, slot_starts) = (np.cumsum(counts, axis=0) - counts).T
+        (num_nodes, num_edges, num_faces, num_slots) = counts.T
+        
+        edges = np.concatenate([item[0] for item in topology]) + np.repeat(node_starts, num_edges)[:,np.newaxis]
+        starts = np.concatenate([item[1] for item in topology]) + np.repeat(slot_starts, num_faces)
+        slot_edges = np.concatenate([item[2] for item in topology]) + np.repeat(edge_starts, num_slots)
+        slot_faces = np.concatenate([item[3] for item in topology]) + np.repeat(face_starts, num_slots)
+        sizes = np.diff(np.append(starts, num_slots.sum()))
+        
+        # The position in the drawing order of the face of each slot, or -1 for faces not drawn
+        face_positions = -np.ones(num_faces.sum(), int)
+        drawn_faces = np.concatenate(face_indices) + np.repeat(face_starts, [len(faces) for faces in face_indices])
+        face_positions[drawn_faces] = position[:len(drawn_faces)]
+        slot_positions = face_positions[slot_faces]
+        
+        # Keep the slot of each edge on a drawn face from the face drawn last
+        slots = np.flatnonzero(slot_positions >= 0)
+        slots = slots[np.lexsort((slot_positions[slots], slot_edges[slots]))]
+        slots = slots[np.append(slot_edges[slots[1:]] != slot_edges[slots[:-1]], True)]
         
-        for name, wireframe in self.wireframes.items():
-            nodes = wireframe.nodes
+        # Number each face's slots from just after one whose edge it doesn't draw, so its edges join into as few polylines as possible
+        kept = np.zeros(len(slot_edges), bool)
+        kept[slots] = True
+        slot_sizes = np.repeat(sizes, sizes)
+        within = np.arange(len(slot_edges)) - np.repeat(starts, sizes)
+        gaps = np.repeat(np.minimum.reduceat(np.where(kept, slot_sizes, within), starts), sizes) if len(slot_edges) else within
+        around = (within - gaps - 1) % np.maximum(slot_sizes, 1)
+        
+        # Order the edges by the face they're drawn after, and around each face, so they join into polylines
+        slots = slots[np.lexsort((around[slots], slot_positions[slots]))]
+        edge_positions = slot_positions[slots]
+        path, runs = polylines(edges[slot_edges[slots]], edge_positions)
+        points = np.vstack([screen_nodes for (screen_nodes, _) in projected])[path].tolist()
+        run_firsts = np.array([start for (start, _) in runs], int) - np.arange(len(runs))
+        return points, runs, edge_positions[run_firsts]
+    
+    def screenDepths(self, nodes):
+        """ Return depths for the nodes that vary linearly across the screen, with lower depths nearer the viewer.
+            With perspective, this is -1 over the distance from the eye along the z-axis. """
+        
+        if not self.perspective:
+            return nodes[:,2]
+        return -1.0 / np.maximum(self.perspective + nodes[:,2], 1e-9)
+    
+    def edgeLines(self, wireframes, projected, colours, drawn_faces):
+        """ Return the edges drawEdges would draw for each wireframe as an (L, 2, 2) array of the screen positions
+            of their ends, an (L, 2) array of their screenDepths and an (L, 3) array of their colours. """
+        
+        points = [np.zeros((0,2,2))]
+        depths = [np.zeros((0,2))]
+        line_colours = [np.zeros((0,3))]
+        for wireframe, (screen_nodes, in_front), colour, drawn in zip(wireframes, projected, colours, drawn_faces):
+            edges = wireframe.edges[self.visibleEdges(wireframe, in_front, drawn)]
+            points.append(screen_nodes[edges])
+            depths.append(self.screenDepths(wireframe.nodes)[edges])
+            line_colours.append(np.repeat([colour], len(edges), axis=0))
+        return np.vstack(points), np.vstack(depths), np.vstack(line_colours)
+    
+    def rasterizeFaces(self, surface, wireframes, projected, faces, shades, lines=None):
+        """ Draw faces to surface with a depth buffer, so the nearest face is drawn at each pixel whatever the order.
+            faces is a list of arrays of the faces to draw of each wireframe, and shades a list of arrays of their colours.
+            With smooth shading, faces are lit at each node from its normal, and the colours blended across them.
+            lines, the arrays from edgeLines, are drawn after the faces where the faces don't hide them. """
+        
+        points = []
+        depths = []
+        colours = []
+        for wireframe, (screen_nodes, _), wireframe_faces, wireframe_shades in zip(wireframes, projected, faces, shades):
+            face_shades = np.zeros((len(wireframe.face_colours), 3))
+            face_shades[wireframe_faces] = wireframe_shades
+            drawn = np.zeros(len(wireframe.face_colours), bool)
+            drawn[wireframe_faces] = True
+            
+            (triangles, triangle_faces) = wireframe.triangles()
+            keep = drawn[triangle_faces]
+            (triangles, triangle_faces) = (triangles[keep], triangle_faces[keep])
+            points.append(screen_nodes[triangles])
+            depths.append(self.screenDepths(wireframe.nodes)[triangles])
             
-            if self.displayFaces:
-                for (face, colour) in wireframe.sortedFaces():
-                    v1 = (nodes[face[1]] - nodes[face[0]])[:3]
-                    v2 = (nodes[face[2]] - nodes[face[0]])[:3]
-                    
-                    normal = np.cross(v1, v2)
-                    towards_us = np.dot(normal, self.view_vector)
-                    
-                    # Only draw faces that face us
-                    if towards_us > 0:
-                        normal /= np.linalg.norm(normal)
-                        theta = np.dot(normal, light)
-                        #catchlight_face = np.dot(normal, spectral_highlight) ** 25
-
-                        c = 0
-                        if theta < 0:
-                            shade = self.min_light * colour
-                        else:
-                            shade = (theta * self.light_range + self.min_light) * colour
-                        pygame.draw.polygon(self.screen, shade, [(nodes[node][0], nodes[node][1]) for node in face], 0)
-                        
-                        #mean_x = sum(nodes[node][0] for node in face) / len(face)
-                        #mean_y = sum(nodes[node][1] for node in face) / len(face)
-                        #pygame.draw.aaline(self.screen, (255,255,255), (mean_x, mean_y), (mean_x+25*normal[0], mean_y+25*normal[1]), 1)
+            if self.shading == 'smooth':
+                node_light = self.lighting(wireframe.nodeNormals())
+                colours.append(node_light[triangles][:,:,np.newaxis] * wireframe.face_colours[triangle_faces][:,np.newaxis])
+            else:
+                colours.append(face_shades[triangle_faces])
+        
+        colour_buffer = pygame.surfarray.array3d(surface)
+        depth_buffer = np.empty(surface.get_size())
+        depth_buffer[:] = np.inf
+        rasterizer.rasterize(colour_buffer, depth_buffer, np.vstack(points), np.vstack(depths), np.vstack(colours))
+        if lines is not None:
+            rasterizer.rasterizeLines(colour_buffer, depth_buffer, *lines)
+        pygame.surfarray.blit_array(surface, colour_buffer)
+    
+    def faceEdgeMask(self, wireframe):
+        """ Return a mask of the edges of a wireframe that are on one of its faces. """
+        
+        on_face = np.zeros(wireframe.num_edges, bool)
+        if len(wireframe.face_colours):
+            on_face[wireframe.faceEdges()[0]] = True
+        return on_face
+    
+    def visibleEdges(self, wireframe, in_front, drawn_faces=None):
+        """ Return a mask of the edges of a wireframe with both nodes in front of the near plane.
+            If drawn_faces, a mask of the faces drawn, is given, edges whose faces were all culled are left out. """
+        
+        visible = in_front[wireframe.edges].all(axis=1)
+        if drawn_faces is not None:
+            (edges, faces) = wireframe.faceEdges()
+            on_drawn_face = np.zeros(wireframe.num_edges, bool)
+            on_drawn_face[edges[drawn_faces[faces]]] = True
+            visible &= on_drawn_face | ~self.faceEdgeMask(wireframe)
+        return visible
+    
+    def drawEdges(self, surface, wireframe, screen_nodes, in_front, colour, drawn_faces=None):
+        """ Draw the edges of a wireframe with both nodes in front of the near plane, joined into antialiased polylines.
+            If drawn_faces, a mask of the faces drawn, is given, edges whose faces were all culled aren't drawn. """
+        
+        self.drawPolylines(surface, wireframe.edges[self.visibleEdges(wireframe, in_front, drawn_faces)], screen_nodes, colour)
+    
+    def drawPolylines(self, surface, edges, screen_nodes, colour):
+        """ Draw an (E, 2) array of edges, joined into antialiased polylines where they meet end to end. """
+        
+        path, runs = polylines(edges)
+        points = screen_nodes[path].tolist()
+        for (start, end) in runs:
+            pygame.draw.aalines(surface, colour, False, points[start:end])
+
+    def draw(self):
+        """ Draw the wireframes to self.screen, recording the time taken in self.stats.
+            Static wireframes are only drawn when they or the view have changed since they were last drawn. """
+        
+        start = timeit.default_timer()
+        for key in ['culled_wireframes', 'visible_faces', 'culled_faces', 'shade_ms', 'sort_ms']:
+            self.stats[key] = 0
+        
+        scene = self.sceneWireframes()
+        static = [item for item in scene if item[0] in self.static]
+        
+        if static:
+            state = self.sceneState(self.static)
+            if state != self.static_state:
+                if self.static_layer is None:
+                    self.static_layer = pygame.Surface(self.screen.get_size())
+                self.static_layer.fill(self.background)
+                self.drawWireframes(self.static_layer, static)
+                
+                # Choosing a level of detail can change the wireframes, so find the state after drawing
+                self.static_state = self.sceneState(self.static)
+            self.screen.blit(self.static_layer, (0, 0))
+        else:
+            self.screen.fill(self.background)
+        
+        moved = self.interpolateWireframes()
+        try:
+            self.drawWireframes(self.screen, [item for item in scene if item[0] not in self.static])
+        finally:
+            # Keep the versions of wireframes that nothing else changed while they were drawn
+            for wireframe, matrix, version in moved:
+                unchanged = wireframe.version == version + 1
+                wireframe.setMatrix(matrix)
+                if unchanged:
+                    wireframe.version = version
+        
+        # Drawing time excludes the time spent shading and sorting faces
+        self.stats['draw_ms'] = 1000 * (timeit.default_timer() - start) - self.stats['shade_ms'] - self.stats['sort_ms']
+    
+    def interpolateWireframes(self):
+        """ Move each wireframe that the last update step moved, and that hasn't changed since, part way between
+            its matrices before and after the step, by self.interpolation, so motion looks smooth whatever the frame rate.
+            This draws one step behind, and suits wireframes that their update moves with transform.
+            Return a list of (wireframe, matrix, version) tuples to put them back with. """
+        
+        moved = []
+        for name, (before, after, version) in self.step_matrices.items():
+            wireframe = self.wireframes.get(name)
+            if wireframe is None or name in self.static or wireframe.version != version:
+                continue
+            moved.append((wireframe, after, version))
+            wireframe.setMatrix((1 - self.interpolation) * before + self.interpolation * after)
+        return moved
+    
+    def drawWireframes(self, surface, scene):
+        """ Draw a list of (name, wireframe, colour) tuples to surface, adding to the counts in self.stats. """
+        
+        # Skip wireframes that are entirely off screen
+        in_view = self.inView([wireframe for (_, wireframe, _) in scene])
+        self.stats['culled_wireframes'] += len(scene) - int(in_view.sum())
+        scene = [scene[i] for i in np.flatnonzero(in_view)]
+        wireframes = [wireframe for (_, wireframe, _) in scene]
+        
+        # Let wireframes with levels of detail choose one for their size on screen
+        for wireframe in wireframes:
+            if hasattr(wireframe, 'chooseResolution') and wireframe.num_nodes:
+                wireframe.chooseResolution(self.screenSize(wireframe.bounds()))
+        
+        # Project every wireframe's nodes once, for the faces, edges and nodes to share
+        projected = [self.projectNodes(wireframe.nodes) for wireframe in wireframes]
+        
+        # With faces, edges are drawn along with them so that faces in front hide them
+        edge_colours = [colour for (_, _, colour) in scene] if self.displayEdges else None
+        if self.displayFaces:
+            drawn_faces = self.drawFaces(surface, wireframes, projected, edge_colours)
+        else:
+            drawn_faces = [None] * len(wireframes)
+        edges_drawn = any(drawn is not None for drawn in drawn_faces)
+        
+        for (_, wireframe, colour), (screen_nodes, in_front) in zip(scene, projected):
             
-                if self.displayEdges:
-                    for (n1, n2) in wireframe.edges:
-                        if self.perspective:
-                            if wireframe.nodes[n1][2] > -self.perspective and nodes[n2][2] > -self.perspective:
-                                z1 = self.perspective/ (self.perspective + nodes[n1][2])
-                                x1 = self.width/2  + z1*(nodes[n1][0] - self.width/2)
-                                y1 = self.height/2 + z1*(nodes[n1][1] - self.height/2)
-                    
-                                z2 = self.perspective/ (self.perspective + nodes[n2][2])
-                                x2 = self.width/2  + z2*(nodes[n2][0] - self.width/2)
-                                y2 = self.height/2 + z2*(nodes[n2][1] - self.height/2)
-                                
-                                pygame.draw.aaline(self.screen, colour, (x1, y1), (x2, y2), 1)
-                        else:
-                            pygame.draw.aaline(self.screen, colour, (nodes[n1][0], nodes[n1][1]), (nodes[n2][0], nodes[n2][1]), 1)
+            if self.displayEdges and not edges_drawn:
+                self.drawEdges(surface, wireframe, screen_nodes, in_front, colour)
 
             if self.displayNodes:
-                for node in nodes:
-                    pygame.draw.circle(self.screen, colour, (int(node[0]), int(node[1])), self.nodeRadius, 0)
+                for (x, y) in screen_nodes[in_front].astype(int).tolist():
+                    pygame.draw.circle(surface, colour, (x, y), self.nodeRadius, 0)
+    
+    def drawStats(self):
+        """ Write self.stats in the top left corner of the screen. """
+        
+        if not pygame.font.get_init():
+            pygame.font.init()
+        font = pygame.font.SysFont(None, 18)
+        
+        for i, key in enumerate(STATS):
+            value = self.stats[key]
+            text = "%s: %d" % (key, value) if isinstance(value, int) else "%s: %.1f" % (key, value)
+            self.screen.blit(font.render(text, True, self.statsColour), (8, 8 + 14*i))
+    
+    def display(self, force=False):
+        """ Draw the wireframes and, unless headless, show them on screen.
+            Unless force is True, the frame is skipped if nothing has changed since the last frame was drawn,
+            except when showing stats, which change every frame. Return whether the frame was drawn. """
+        
+        # Wireframes moved by the last update step are drawn in a different place as interpolation changes
+        names = list(self.wireframes) + list(self.terrains)
+        state = (self.sceneState(names), self.interpolation if self.step_matrices else None)
+        if not (force or self.displayStats) and state == self.drawn_state:
+            return False
+        
+        self.draw()
+        self.drawn_state = (self.sceneState(names), state[1])
+        if self.displayStats:
+            self.drawStats()
+        if not self.headless:
+            pygame.display.flip()
+        return True
+    
+    def renderFrame(self):
+        """ Draw the wireframes and return the pixels as a (height, width, 3) array of RGB values. """
         
-        pygame.display.flip()
+        self.draw()
+        return pygame.surfarray.array3d(self.screen).swapaxes(0, 1)
 
     def keyEvent(self, key):
         if key in key_to_function:
             key_to_function[key](self)
             #light_movement[key](self.light)
 
+    def advance(self, elapsed):
+        """ Update the wireframes in fixed steps of self.time_step for the elapsed time in seconds,
+            plus any time left over from before, and return the number of steps run.
+            If more than self.max_updates steps are due, the time the extra steps would cover is dropped,
+            so the animation slows down rather than falling further and further behind. """
+        
+        self.lag += elapsed
+        steps = 0
+        while self.lag >= self.time_step and steps < self.max_updates:
+            before = dict((name, wireframe.matrix) for name, wireframe in self.wireframes.items())
+            self.update(self.time_step)
+            self.lag -= self.time_step
+            steps += 1
+        
+        # Transforms replace the matrix, so wireframes with a new matrix were moved by the last step
+        if steps:
+            self.step_matrices = dict((name, (before[name], wireframe.matrix, wireframe.version))
+                                      for name, wireframe in self.wireframes.items()
+                                      if name in before and wireframe.matrix is not before[name])
+        
+        if self.lag >= self.time_step:
+            self.lag %= self.time_step
+        self.interpolation = self.lag / self.time_step
+        return steps
+    
     def run(self):
-        """ Display wireframe on screen and respond to keydown events """
+        """ Display wireframe on screen and respond to keydown events.
+            Wireframes are updated with advance, so they move at the same speed whatever the frame rate.
+            The frame rate is capped at self.target_fps, and self.stats_callback, if set,
+            is called with self.stats after each frame. """
         
+        clock = pygame.time.Clock()
         running = True
         key_down = False
+        previous = timeit.default_timer()
         while running:
+            start = timeit.default_timer()
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
@@ -174,8 +771,19 @@ class WireframeViewer(wf.WireframeGroup):
             
             if key_down:
                 self.keyEvent(key_down)
+            self.stats['events_ms'] = 1000 * (timeit.default_timer() - start)
+            
+            start = timeit.default_timer()
+            self.stats['updates'] = self.advance(start - previous)
+            previous = start
+            self.stats['update_ms'] = 1000 * (timeit.default_timer() - start)
             
             self.display()
-            self.update()
+            
+            if self.stats_callback:
+                self.stats_callback(self.stats)
+            
+            clock.tick(self.target_fps)
+            self.stats['fps'] = clock.get_fps()
             
         pygame.quit()
\ No newline at end of file